@@ -25,9 +25,13 @@ def create_app(config_class=Config):
     mail.init_app(app)
 
     from library_app.models import User, Section, Book
+    from library_app.utils import upgrade_schema
+    from library_app.search import create_search_index
 
     with app.app_context():
         db.create_all()
+        upgrade_schema()
+        create_search_index()
 
         section = Section.query.filter_by(title="Miscellaneous").first()
 
@@ -51,4 +55,62 @@ def create_app(config_class=Config):
     app.register_blueprint(librarian)
     app.register_blueprint(errors)
 
+    from library_app.autocomplete import autocomplete_index
+
+    autocomplete_index.init_app(app)
+
+    from library_app.cache import catalog_cache, fragment_cache, page_cache
+
+    catalog_cache.init_app(app)
+    fragment_cache.init_app(app)
+    page_cache.init_app(app)
+
+    from library_app.assets import asset_pipeline
+
+    asset_pipeline.init_app(app)
+
+    from library_app.blobs import blob_store
+
+    blob_store.init_app(app)
+
+    from library_app.pdfs import pdf_delivery, pdf_pages
+
+    pdf_delivery.init_app(app)
+    pdf_pages.init_app(app)
+
+    from library_app.images import image_resizer
+
+    image_resizer.init_app(app)
+
+    from library_app.jobs import job_queue
+    import library_app.tasks
+
+    job_queue.init_app(app)
+
+    from library_app.charts import chart_renderer
+
+    chart_renderer.init_app(app)
+
+    from library_app.commands import (
+        backfill_ratings,
+        rebuild_search,
+        index_pdfs,
+        backfill_pdfs,
+        run_jobs,
+        job_status,
+        build_picture_variants,
+        migrate_blobs,
+        collect_orphans,
+    )
+
+    app.cli.add_command(backfill_ratings)
+    app.cli.add_command(rebuild_search)
+    app.cli.add_command(index_pdfs)
+    app.cli.add_command(backfill_pdfs)
+    app.cli.add_command(run_jobs)
+    app.cli.add_command(job_status)
+    app.cli.add_command(build_picture_variants)
+    app.cli.add_command(migrate_blobs)
+    app.cli.add_command(collect_orphans)
+
     return app
@@ -0,0 +1,183 @@
+import gzip
+import mimetypes
+import os
+import re
+import threading
+from hashlib import sha256
+from flask import url_for, send_file, request, abort
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".txt", ".json", ".ico"}
+ASSET_FOLDERS = ("main",)
+HASHED_NAME = re.compile(r"^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[^./]+)$")
+
+VARIANT_NAME = re.compile(r"-\d+w\.webp$")
+BLOB_NAME = re.compile(r"^(?P<digest>[0-9a-f]{64})(\.[^./]+)?$")
+
+
+def blob_digest(filename):
+    blob = BLOB_NAME.match(os.path.basename(filename))
+    return None if blob is None else blob.group("digest")[:12]
+
+
+def variant_name(filename, width):
+    return f"{os.path.splitext(filename)[0]}-{width}w.webp"
+
+
+class AssetPipeline:
+    def __init__(self):
+        self.digests = {}
+        self.lock = threading.Lock()
+        self.static_folder = None
+        self.compressed_folder = None
+        self.max_age = 31536000
+        self.picture_widths = (160, 320, 480)
+        self.external = None
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.compressed_folder = os.path.join(app.instance_path, "assets")
+        self.max_age = app.config["ASSET_MAX_AGE"]
+        self.picture_widths = app.config["PICTURE_WIDTHS"]
+        app.add_url_rule(
+            "/assets/<path:filename>", "assets", self.serve, methods=["GET"]
+        )
+        app.jinja_env.globals["url_for"] = self.url_for
+        app.add_template_global(self.srcset, "picture_srcset")
+        self.build()
+
+    def build(self):
+        built = 0
+        for folder in ASSET_FOLDERS:
+            for root, dirs, files in os.walk(os.path.join(self.static_folder, folder)):
+                for name in files:
+                    if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                        continue
+                    path = os.path.join(root, name)
+                    filename = os.path.relpath(path, self.static_folder)
+                    filename = filename.replace(os.sep, "/")
+                    self.compress(filename, self.digest(filename))
+                    built += 1
+        return built
+
+    def digest(self, filename):
+        path = os.path.join(self.static_folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        digest = blob_digest(filename)
+        if digest is not None:
+            return digest
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            cached = self.digests.get(filename)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        with open(path, "rb") as asset:
+            digest = sha256(asset.read()).hexdigest()[:12]
+        with self.lock:
+            self.digests[filename] = (key, digest)
+        return digest
+
+    def hashed_name(self, filename, digest):
+        stem, ext = os.path.splitext(filename)
+        return f"{stem}.{digest}{ext}"
+
+    def compress(self, filename, digest):
+        if os.path.splitext(filename)[1] not in COMPRESSIBLE_EXTENSIONS:
+            return
+        target = os.path.join(
+            self.compressed_folder, self.hashed_name(filename, digest)
+        )
+        encoders = [(".gz", lambda data: gzip.compress(data, 9, mtime=0))]
+        if brotli is not None:
+            encoders.append((".br", lambda data: brotli.compress(data, quality=11)))
+        missing = [
+            (suffix, encode)
+            for suffix, encode in encoders
+            if not os.path.exists(target + suffix)
+        ]
+        if not missing:
+            return
+        with open(os.path.join(self.static_folder, filename), "rb") as asset:
+            data = asset.read()
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        for suffix, encode in missing:
+            temporary = f"{target}{suffix}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as compressed:
+                compressed.write(encode(data))
+            os.replace(temporary, target + suffix)
+
+    def url_for(self, endpoint, **values):
+        if endpoint == "static" and "filename" in values:
+            digest = self.digest(values["filename"])
+            if digest is not None:
+                values["filename"] = self.hashed_name(values["filename"], digest)
+                return url_for("assets", **values)
+            if self.external is not None:
+                url = self.external(values["filename"])
+                if url is not None:
+                    return url
+        return url_for(endpoint, **values)
+
+    def srcset(self, filename):
+        candidates = []
+        for width in self.picture_widths:
+            name = variant_name(filename, width)
+            digest = self.digest(name)
+            if digest is not None:
+                url = url_for("assets", filename=self.hashed_name(name, digest))
+            elif self.external is not None:
+                url = self.external(name)
+            else:
+                url = None
+            if url is not None:
+                candidates.append(f"{url} {width}w")
+        return ", ".join(candidates)
+
+    def serve(self, filename):
+        match = HASHED_NAME.match(filename)
+        if match is None:
+            abort(404)
+        original = match.group("stem") + match.group("ext")
+        if safe_join(self.static_folder, original) is None:
+            abort(404)
+        digest = self.digest(original)
+        if digest is None:
+            abort(404)
+        current = digest == match.group("digest")
+        path = os.path.join(self.static_folder, original)
+        encoding = None
+        if current:
+            self.compress(original, digest)
+            compressed = os.path.join(self.compressed_folder, filename)
+            for suffix, name in ((".br", "br"), (".gz", "gzip")):
+                if name in request.accept_encodings and os.path.exists(
+                    compressed + suffix
+                ):
+                    path, encoding = compressed + suffix, name
+                    break
+        response = send_file(
+            path,
+            mimetype=mimetypes.guess_type(original)[0] or "application/octet-stream",
+            conditional=True,
+            etag=f"{digest}-{encoding}" if encoding else digest,
+            max_age=self.max_age if current else 0,
+        )
+        response.headers.pop("Content-Disposition", None)
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        if current:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        return response
+
+
+asset_pipeline = AssetPipeline()
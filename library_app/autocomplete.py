@@ -0,0 +1,96 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from library_app import db
+from library_app.models import Section, Book
+
+
+def normalize(text):
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.keys = []
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        with app.app_context():
+            self.rebuild()
+
+    def rebuild(self):
+        keys, entries = [], {}
+        for sectionid, title in db.session.query(Section.sectionid, Section.title):
+            entry_keys = self.keys_for(title)
+            entries[("section", sectionid)] = (title, entry_keys)
+            keys.extend((key, "section", sectionid) for key in entry_keys)
+        for bookid, title, author in db.session.query(
+            Book.bookid, Book.title, Book.author
+        ):
+            entry_keys = self.keys_for(title, author)
+            entries[("book", bookid)] = (f"{title} by {author}", entry_keys)
+            keys.extend((key, "book", bookid) for key in entry_keys)
+        keys.sort()
+        with self.lock:
+            self.keys, self.entries = keys, entries
+
+    @staticmethod
+    def keys_for(*texts):
+        keys = set()
+        for text in texts:
+            words = normalize(text).split()
+            keys.update(" ".join(words[start:]) for start in range(len(words)))
+        return keys
+
+    def add(self, kind, entityid, label, *texts):
+        self.remove(kind, entityid)
+        entry_keys = self.keys_for(*texts)
+        with self.lock:
+            self.entries[(kind, entityid)] = (label, entry_keys)
+            for key in entry_keys:
+                insort(self.keys, (key, kind, entityid))
+
+    def remove(self, kind, entityid):
+        with self.lock:
+            entry = self.entries.pop((kind, entityid), None)
+            if entry is None:
+                return
+            for key in entry[1]:
+                position = bisect_left(self.keys, (key, kind, entityid))
+                if self.keys[position : position + 1] == [(key, kind, entityid)]:
+                    del self.keys[position]
+
+    def add_book(self, book):
+        label = f"{book.title} by {book.author}"
+        self.add("book", book.bookid, label, book.title, book.author)
+
+    def remove_book(self, bookid):
+        self.remove("book", bookid)
+
+    def add_section(self, section):
+        self.add("section", section.sectionid, section.title, section.title)
+
+    def remove_section(self, sectionid):
+        self.remove("section", sectionid)
+
+    def complete(self, prefix, limit=8):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        suggestions, seen = [], set()
+        with self.lock:
+            position = bisect_left(self.keys, (prefix,))
+            while position < len(self.keys) and len(suggestions) < limit:
+                key, kind, entityid = self.keys[position]
+                if not key.startswith(prefix):
+                    break
+                if (kind, entityid) not in seen:
+                    seen.add((kind, entityid))
+                    label = self.entries[(kind, entityid)][0]
+                    suggestions.append((kind, entityid, label))
+                position += 1
+        return suggestions
+
+
+autocomplete_index = PrefixIndex()
@@ -0,0 +1,539 @@
+import mimetypes
+import os
+import secrets
+import shutil
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from datetime import datetime, timezone
+from itertools import groupby
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from library_app import db
+from library_app.models import Blob, Book, Section, User
+from library_app.assets import asset_pipeline, variant_name, VARIANT_NAME
+from library_app.cache import DiskCache
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+CHUNK_SIZE = 1024 * 1024
+ORPHAN_BATCH_SIZE = 500
+
+OrphanReport = namedtuple("OrphanReport", ["scanned", "orphans", "reclaimed", "cursor"])
+
+DEFAULT_FILES = {
+    "default_book_picture.png",
+    "default_section_picture.jpeg",
+    "default_profile_picture.png",
+    "sample_pdf.pdf",
+}
+
+
+def shard(filename):
+    return f"{filename[:2]}/{filename[2:4]}/{filename}"
+
+
+def file_stem(filename):
+    stem = VARIANT_NAME.sub("", filename)
+    return stem if stem != filename else os.path.splitext(filename)[0]
+
+
+def directory_batches(entries, size):
+    batch = []
+    for directory, files in groupby(
+        entries, key=lambda entry: entry[0].rpartition("/")[0]
+    ):
+        batch.extend(files)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def file_digest(path):
+    digest = sha256()
+    with open(path, "rb") as blob:
+        for chunk in iter(lambda: blob.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_references():
+    return (
+        (Book.picture, "book/pictures", ()),
+        (Book.pdf_file, "book/pdfs", ()),
+        (Section.picture, "section", ()),
+        (User.profile_picture, "user/profile_pictures", (User.urole != "librarian",)),
+        (
+            User.profile_picture,
+            "librarian/profile_pictures",
+            (User.urole == "librarian",),
+        ),
+    )
+
+
+class LocalBackend:
+    remote = False
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def store(self, key, source):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(source, path)
+        except OSError:
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            shutil.copyfile(source, temporary)
+            os.replace(temporary, path)
+            os.remove(source)
+
+    def fetch(self, key):
+        return self.path(key)
+
+    def delete(self, key):
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+
+    def url(self, key):
+        return None
+
+    def listing(self, prefix, after=None):
+        try:
+            with os.scandir(self.path(prefix)) as scanned:
+                entries = sorted(
+                    (f"{entry.name}/" if entry.is_dir() else entry.name, entry)
+                    for entry in scanned
+                )
+        except FileNotFoundError:
+            return
+        for name, entry in entries:
+            key = f"{prefix}/{entry.name}"
+            if entry.is_dir():
+                if after is None or after < key + "0":
+                    yield from self.listing(key, after)
+            elif after is None or key > after:
+                stat = entry.stat()
+                yield key, stat.st_size, stat.st_mtime
+
+    def move(self, key, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(self.path(key), path)
+
+
+class S3Backend:
+    remote = True
+
+    def __init__(self, bucket, prefix, endpoint_url, public_url, cache):
+        if boto3 is None:
+            raise RuntimeError("BLOB_BACKEND=s3 needs the boto3 package")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.public_url = public_url
+        self.cache = cache
+        self.known = {}
+        self.lock = threading.Lock()
+
+    def name(self, key):
+        return self.prefix + key
+
+    def remember(self, key, exists):
+        with self.lock:
+            if len(self.known) > 65536:
+                self.known.clear()
+            self.known[key] = exists
+
+    def exists(self, key):
+        with self.lock:
+            known = self.known.get(key)
+        if known is None:
+            try:
+                self.client.head_object(Bucket=self.bucket, Key=self.name(key))
+                known = True
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                    raise
+                known = False
+            self.remember(key, known)
+        return known
+
+    def store(self, key, source):
+        self.client.upload_file(
+            source,
+            self.bucket,
+            self.name(key),
+            ExtraArgs={
+                "ContentType": mimetypes.guess_type(key)[0]
+                or "application/octet-stream",
+                "CacheControl": "public, max-age=31536000, immutable",
+            },
+        )
+        os.remove(source)
+        self.remember(key, True)
+
+    def fetch(self, key):
+        path = self.cache.path(*key.split("/"))
+        if self.cache.hit(path):
+            return path
+        try:
+            return self.cache.store(
+                path,
+                lambda target: self.client.download_file(
+                    self.bucket, self.name(key), target
+                ),
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            return path
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.name(key))
+        self.remember(key, False)
+        path = self.cache.path(*key.split("/"))
+        if os.path.exists(path):
+            os.remove(path)
+
+    def url(self, key):
+        if self.public_url:
+            return f"{self.public_url.rstrip('/')}/{self.name(key)}"
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.name(key)}
+        )
+
+    def listing(self, prefix, after=None):
+        options = {"Bucket": self.bucket, "Prefix": self.name(prefix + "/")}
+        if after is not None:
+            options["StartAfter"] = self.name(after)
+        for page in self.client.get_paginator("list_objects_v2").paginate(**options):
+            for item in page.get("Contents", []):
+                yield (
+                    item["Key"][len(self.prefix) :],
+                    item["Size"],
+                    item["LastModified"].timestamp(),
+                )
+
+    def move(self, key, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.client.download_file(self.bucket, self.name(key), path)
+        self.delete(key)
+
+
+class BlobStore:
+    def __init__(self):
+        self.static_folder = None
+        self.upload_folder = None
+        self.backend = None
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.upload_folder = os.path.join(app.instance_path, "uploads")
+        backend = app.config["BLOB_BACKEND"]
+        if backend == "local":
+            self.backend = LocalBackend(app.static_folder)
+        elif backend == "s3":
+            self.backend = S3Backend(
+                app.config["BLOB_S3_BUCKET"],
+                app.config["BLOB_S3_PREFIX"],
+                app.config["BLOB_S3_ENDPOINT_URL"],
+                app.config["BLOB_S3_PUBLIC_URL"],
+                DiskCache(
+                    app.config["BLOB_CACHE_FOLDER"]
+                    or os.path.join(app.instance_path, "blobs"),
+                    app.config["BLOB_CACHE_MAX_BYTES"],
+                ),
+            )
+            asset_pipeline.external = self.url
+        else:
+            raise ValueError(f"Unknown blob backend {backend!r}")
+
+    def folder(self, folder):
+        return folder.replace("\\", "/").strip("/")
+
+    def key(self, folder, filename):
+        return f"{self.folder(folder)}/{filename}"
+
+    def static_path(self, folder, filename):
+        return os.path.join(
+            self.static_folder, *self.key(folder, filename).split("/")
+        )
+
+    def path(self, folder, filename):
+        path = self.static_path(folder, filename)
+        if not self.backend.remote or os.path.exists(path):
+            return path
+        return self.backend.fetch(self.key(folder, filename))
+
+    def url(self, filename):
+        if self.backend.exists(filename):
+            return self.backend.url(filename)
+        return None
+
+    def receive(self, upload):
+        os.makedirs(self.upload_folder, exist_ok=True)
+        path = os.path.join(self.upload_folder, f"{secrets.token_hex(16)}.upload")
+        digest = sha256()
+        with open(path, "wb") as received:
+            for chunk in iter(lambda: upload.stream.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                received.write(chunk)
+        return path, digest.hexdigest()
+
+    def store(self, folder, filename, workspace):
+        directory = os.path.dirname(self.key(folder, filename))
+        for name in sorted(
+            os.listdir(workspace), key=lambda name: name == os.path.basename(filename)
+        ):
+            self.backend.store(f"{directory}/{name}", os.path.join(workspace, name))
+
+    def put(self, folder, upload, write):
+        folder = self.folder(folder)
+        received, digest = self.receive(upload)
+        filename = shard(digest + os.path.splitext(upload.filename)[1].lower())
+        workspace = os.path.join(self.upload_folder, secrets.token_hex(16))
+        try:
+            self.retain(folder, filename, digest)
+            if not self.backend.exists(self.key(folder, filename)):
+                try:
+                    os.makedirs(workspace)
+                    write(received, os.path.join(workspace, os.path.basename(filename)))
+                    self.store(folder, filename, workspace)
+                except Exception:
+                    self.release(folder, filename)
+                    raise
+        finally:
+            os.remove(received)
+            shutil.rmtree(workspace, ignore_errors=True)
+        return filename
+
+    def retain(self, folder, filename, digest, count=1):
+        blobs = Blob.__table__
+        for attempt in range(2):
+            try:
+                with db.engine.begin() as connection:
+                    if connection.execute(
+                        blobs.update()
+                        .where(blobs.c.folder == folder, blobs.c.filename == filename)
+                        .values(
+                            refcount=blobs.c.refcount + count,
+                            date_updated=datetime.now(timezone.utc),
+                        )
+                    ).rowcount:
+                        return
+                    connection.execute(
+                        blobs.insert().values(
+                            folder=folder,
+                            filename=filename,
+                            digest=digest,
+                            refcount=count,
+                            date_created=datetime.now(timezone.utc),
+                            date_updated=datetime.now(timezone.utc),
+                        )
+                    )
+                    return
+            except IntegrityError:
+                if attempt:
+                    raise
+
+    def references(self, folder, filename):
+        blobs = Blob.__table__
+        with db.engine.connect() as connection:
+            return connection.execute(
+                select(blobs.c.refcount).where(
+                    blobs.c.folder == self.folder(folder), blobs.c.filename == filename
+                )
+            ).scalar()
+
+    def release(self, folder, filename):
+        folder = self.folder(folder)
+        blobs = Blob.__table__
+        match = (blobs.c.folder == folder, blobs.c.filename == filename)
+        with db.engine.begin() as connection:
+            if connection.execute(
+                blobs.update()
+                .where(*match, blobs.c.refcount > 1)
+                .values(refcount=blobs.c.refcount - 1)
+            ).rowcount:
+                return False
+            connection.execute(blobs.delete().where(*match))
+            self.remove(folder, filename)
+        return True
+
+    def remove(self, folder, filename):
+        for name in [filename] + [
+            variant_name(filename, width)
+            for width in current_app.config["PICTURE_WIDTHS"]
+        ]:
+            path = self.static_path(folder, name)
+            if os.path.exists(path):
+                os.remove(path)
+            if self.backend.remote:
+                self.backend.delete(self.key(folder, name))
+
+    def migrate_file(self, folder, filename):
+        if filename in DEFAULT_FILES:
+            return None
+        source = self.static_path(folder, filename)
+        if not os.path.exists(source):
+            if self.backend.exists(self.key(folder, filename)):
+                return None
+            raise FileNotFoundError("the file is missing")
+        digest = file_digest(source)
+        migrated = shard(digest + os.path.splitext(filename)[1].lower())
+        if migrated == filename and not self.backend.remote:
+            return None
+        workspace = os.path.join(self.upload_folder, secrets.token_hex(16))
+        os.makedirs(workspace)
+        try:
+            for width in current_app.config["PICTURE_WIDTHS"]:
+                variant = variant_name(source, width)
+                if os.path.exists(variant):
+                    os.replace(
+                        variant,
+                        os.path.join(
+                            workspace,
+                            os.path.basename(variant_name(migrated, width)),
+                        ),
+                    )
+            os.replace(source, os.path.join(workspace, os.path.basename(migrated)))
+            if not self.backend.exists(self.key(folder, migrated)):
+                self.store(folder, migrated, workspace)
+        finally:
+            shutil.rmtree(workspace, ignore_errors=True)
+        return migrated, digest
+
+    def migrate(self, workers, echo=print):
+        files = []
+        for column, folder, conditions in blob_references():
+            files.extend(
+                (column, folder, conditions, filename)
+                for (filename,) in db.session.query(column)
+                .filter(*conditions)
+                .distinct()
+            )
+        app = current_app._get_current_object()
+        with ThreadPoolExecutor(workers) as executor:
+            results = list(
+                executor.map(
+                    lambda entry: self.migrate_in_context(app, entry[1], entry[3]),
+                    files,
+                )
+            )
+        moved = 0
+        for (column, folder, conditions, filename), result in zip(files, results):
+            if isinstance(result, Exception):
+                echo(f"Skipped {folder}/{filename}: {result}")
+                continue
+            if result is None:
+                continue
+            migrated, digest = result
+            references = column.class_.query.filter(column == filename, *conditions)
+            count = references.count()
+            references.update({column: migrated}, synchronize_session=False)
+            Blob.query.filter_by(folder=folder, filename=filename).delete()
+            db.session.commit()
+            self.retain(folder, migrated, digest, count)
+            moved += 1
+        return moved
+
+    def migrate_in_context(self, app, folder, filename):
+        with app.app_context():
+            try:
+                return self.migrate_file(folder, filename)
+            except OSError as e:
+                return e
+
+    def collect_orphans(
+        self, min_age, max_files=None, after=None, quarantine=None, dry_run=False
+    ):
+        columns = {}
+        for column, folder, conditions in blob_references():
+            columns.setdefault(folder, []).append(column)
+        cutoff = time.time() - min_age
+        batch_size = min(ORPHAN_BATCH_SIZE, max_files or ORPHAN_BATCH_SIZE)
+        scanned = orphans = reclaimed = 0
+        for folder in sorted(columns):
+            for batch in directory_batches(
+                self.backend.listing(folder, after), batch_size
+            ):
+                found, size = self.sweep(
+                    folder, columns[folder], batch, cutoff, quarantine, dry_run
+                )
+                scanned += len(batch)
+                orphans += found
+                reclaimed += size
+                if max_files is not None and scanned >= max_files:
+                    return OrphanReport(scanned, orphans, reclaimed, batch[-1][0])
+        return OrphanReport(scanned, orphans, reclaimed, None)
+
+    def sweep(self, folder, columns, entries, cutoff, quarantine, dry_run):
+        groups = {}
+        for key, size, mtime in entries:
+            filename = key[len(folder) + 1 :]
+            groups.setdefault(file_stem(filename), []).append(
+                (key, filename, size, mtime)
+            )
+        originals = [
+            filename
+            for files in groups.values()
+            for key, filename, size, mtime in files
+            if not VARIANT_NAME.search(filename)
+        ]
+        kept = {os.path.splitext(filename)[0] for filename in DEFAULT_FILES}
+        for column in columns:
+            kept.update(
+                os.path.splitext(filename)[0]
+                for (filename,) in db.session.query(column)
+                .filter(column.in_(originals))
+                .distinct()
+            )
+        kept.update(
+            os.path.splitext(filename)[0]
+            for (filename,) in db.session.query(Blob.filename).filter(
+                Blob.folder == folder,
+                Blob.filename.in_(originals),
+                Blob.date_updated > datetime.fromtimestamp(cutoff, timezone.utc),
+            )
+        )
+        blobs = Blob.__table__
+        found = reclaimed = 0
+        for stem, files in groups.items():
+            if stem in kept or any(file[3] > cutoff for file in files):
+                continue
+            found += len(files)
+            reclaimed += sum(size for key, filename, size, mtime in files)
+            if dry_run:
+                continue
+            with db.engine.begin() as connection:
+                connection.execute(
+                    blobs.delete().where(
+                        blobs.c.folder == folder,
+                        blobs.c.filename.in_([file[1] for file in files]),
+                    )
+                )
+                for key, filename, size, mtime in files:
+                    if quarantine is None:
+                        self.backend.delete(key)
+                    else:
+                        target = os.path.join(quarantine, *key.split("/"))
+                        self.backend.move(key, target)
+        return found, reclaimed
+
+
+blob_store = BlobStore()
@@ -0,0 +1,292 @@
+import os
+import threading
+import time
+from hashlib import sha1
+from collections import OrderedDict
+from functools import wraps
+from flask_login import current_user
+from flask import (
+    g,
+    has_request_context,
+    render_template,
+    request,
+    session,
+    make_response,
+)
+from markupsafe import Markup
+from library_app import db
+from library_app.models import CatalogVersion
+
+
+class CatalogCache:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.local_version = 0
+        self.seen_version = None
+        self.backend = "local"
+        self.max_entries = 512
+        self.ttl = 300
+
+    def init_app(self, app):
+        self.backend = app.config["CATALOG_CACHE_BACKEND"]
+        self.max_entries = app.config["CATALOG_CACHE_SIZE"]
+        self.ttl = app.config["CATALOG_CACHE_TTL"]
+        if self.backend not in ("local", "database"):
+            raise ValueError(f"Unknown catalog cache backend {self.backend!r}")
+        with app.app_context():
+            if db.session.get(CatalogVersion, 1) is None:
+                db.session.add(CatalogVersion())
+                db.session.commit()
+
+    def version(self):
+        if self.backend == "local":
+            return self.local_version
+        return self.stored_version()
+
+    def stored_version(self):
+        if has_request_context() and "catalog_version" in g:
+            return g.catalog_version
+        version = db.session.get(CatalogVersion, 1, populate_existing=True).version
+        if has_request_context():
+            g.catalog_version = version
+        if self.backend == "local":
+            with self.lock:
+                if version != self.seen_version:
+                    self.entries.clear()
+                    self.local_version += 1
+                    self.seen_version = version
+        return version
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.local_version += 1
+        with db.engine.begin() as connection:
+            connection.execute(
+                CatalogVersion.__table__.update()
+                .where(CatalogVersion.versionid == 1)
+                .values(version=CatalogVersion.version + 1)
+            )
+        if has_request_context():
+            g.pop("catalog_version", None)
+
+    def get_or_load(self, key, loader):
+        key = (self.version(), key)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                return entry[1]
+        value = loader()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def cached(self, fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+            return self.get_or_load(key, lambda: fn(*args, **kwargs))
+
+        return wrapper
+
+
+class FragmentCache:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_entries = 4096
+        self.ttl = 300
+
+    def init_app(self, app):
+        self.max_entries = app.config["FRAGMENT_CACHE_SIZE"]
+        self.ttl = app.config["FRAGMENT_CACHE_TTL"]
+        app.add_template_global(self.render, "card_fragment")
+
+    def render(self, template_name, entity):
+        name = entity.__tablename__
+        key = (template_name, name, entity.identity, entity.date_updated)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                return entry[1]
+        fragment = Markup(render_template(template_name, **{name: entity}))
+        with self.lock:
+            self.entries[key] = (now + self.ttl, fragment)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return fragment
+
+
+class PageCache:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.size = 0
+        self.max_bytes = 32 * 1024 * 1024
+        self.ttl = 300
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.max_bytes = app.config["PAGE_CACHE_MAX_BYTES"]
+        self.ttl = app.config["CATALOG_CACHE_TTL"]
+
+    def evict(self, key):
+        self.size -= len(self.entries.pop(key)[1])
+
+    def cached(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET" or "_flashes" in session:
+                return view(*args, **kwargs)
+            key = (catalog_cache.version(), request.full_path)
+            now = time.monotonic()
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] <= now:
+                    self.evict(key)
+                    entry = None
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if entry is not None:
+                response = make_response(entry[1])
+                response.content_type = entry[2]
+                response.headers["X-Page-Cache"] = "HIT"
+                response.vary.add("Cookie")
+                return response
+            response = make_response(view(*args, **kwargs))
+            response.headers["X-Page-Cache"] = "MISS"
+            response.vary.add("Cookie")
+            if response.status_code != 200 or session.modified:
+                return response
+            body = response.get_data()
+            if len(body) > self.max_bytes:
+                return response
+            with self.lock:
+                if key in self.entries:
+                    self.evict(key)
+                self.entries[key] = (now + self.ttl, body, response.content_type)
+                self.size += len(body)
+                while self.size > self.max_bytes:
+                    self.evict(next(iter(self.entries)))
+            return response
+
+        return wrapper
+
+
+class DiskCache:
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.size = None
+        self.lock = threading.Lock()
+
+    def path(self, *parts):
+        return os.path.join(self.folder, *parts)
+
+    def hit(self, path):
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def store(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            write(temporary)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        self.track(path)
+        return path
+
+    def usage(self):
+        entries = []
+        for root, dirs, files in os.walk(self.folder):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def track(self, path):
+        with self.lock:
+            if self.size is None:
+                self.size = sum(entry[1] for entry in self.usage())
+            else:
+                self.size += os.path.getsize(path)
+            if self.size > self.max_bytes:
+                self.size = self.evict(self.max_bytes * 9 // 10, path)
+
+    def evict(self, target, keep=None):
+        entries = sorted(self.usage())
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in entries:
+            if size <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+        return size
+
+
+def conditional(last_modified, fingerprint=None):
+    def wrapper(view):
+        @wraps(view)
+        def check(*args, **kwargs):
+            if request.method != "GET" or "_flashes" in session:
+                return view(*args, **kwargs)
+            parts = [
+                catalog_cache.stored_version(),
+                request.full_path,
+                current_user.get_id(),
+            ]
+            if fingerprint is not None:
+                parts.append(fingerprint(**kwargs))
+            etag = sha1(repr(parts).encode("utf-8")).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.last_modified = last_modified(**kwargs)
+            response.set_etag(etag)
+            response.vary.add("Cookie")
+            response.cache_control.no_cache = True
+            if current_user.is_authenticated:
+                response.cache_control.private = True
+            return response
+
+        return check
+
+    return wrapper
+
+
+catalog_cache = CatalogCache()
+fragment_cache = FragmentCache()
+page_cache = PageCache()
@@ -0,0 +1,215 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from collections import namedtuple
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from flask import current_app, abort
+from sqlalchemy import func, tuple_, inspect
+from sqlalchemy.orm import joinedload
+from library_app import db
+from library_app.models import Section, Book, Feedback
+from library_app.search import search_catalog, search_book_pages, search_fuzzy
+from library_app.cache import catalog_cache
+
+BooksPage = namedtuple("BooksPage", ["books", "prev_cursor", "next_cursor", "per_page"])
+
+SectionBooks = namedtuple("SectionBooks", ["section", "page"])
+
+BookDetails = namedtuple("BookDetails", ["book", "feedbacks"])
+
+CatalogSearch = namedtuple("CatalogSearch", ["mode", "results", "sections", "books"])
+
+SEARCH_MODES = ("catalog", "content", "fuzzy")
+
+FEEDBACK_USER_FIELDS = ("userid", "name", "username", "profile_picture")
+
+
+@lru_cache(maxsize=None)
+def record_type(model, fields):
+    primary_key = tuple(column.key for column in model.__table__.primary_key)
+    return type(
+        f"{model.__name__}Record",
+        (namedtuple(f"{model.__name__}Record", fields),),
+        {
+            "__slots__": (),
+            "__tablename__": model.__tablename__,
+            "identity": property(
+                lambda record: tuple(getattr(record, key) for key in primary_key)
+            ),
+        },
+    )
+
+
+def record(instance, fields=None, **related):
+    mapper = inspect(instance).mapper
+    if fields is None:
+        fields = tuple(column.key for column in mapper.column_attrs)
+    values = {field: getattr(instance, field) for field in fields}
+    values.update(related)
+    return record_type(mapper.class_, tuple(values))(**values)
+
+
+def encode_cursor(book):
+    key = f"{book.rating_sum}|{book.date_created.isoformat()}|{book.bookid}"
+    return urlsafe_b64encode(key.encode("utf-8")).decode("utf-8").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        key = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        rating_sum, date_created, bookid = key.split("|")
+        return int(rating_sum), date.fromisoformat(date_created), int(bookid)
+    except ValueError:
+        abort(400)
+
+
+def paginate_books(query, per_page=None, after=None, before=None):
+    if per_page is None:
+        per_page = current_app.config["BOOKS_PER_PAGE"]
+    per_page = max(1, min(per_page, current_app.config["MAX_BOOKS_PER_PAGE"]))
+    key = tuple_(Book.rating_sum, Book.date_created, Book.bookid)
+    if before:
+        books = (
+            query.filter(key > decode_cursor(before))
+            .order_by(Book.rating_sum, Book.date_created, Book.bookid)
+            .limit(per_page + 1)
+            .all()
+        )
+        has_more = len(books) > per_page
+        books = books[:per_page][::-1]
+        prev_cursor = encode_cursor(books[0]) if has_more else None
+        next_cursor = encode_cursor(books[-1]) if books else None
+    else:
+        if after:
+            query = query.filter(key < decode_cursor(after))
+        books = (
+            query.order_by(
+                Book.rating_sum.desc(), Book.date_created.desc(), Book.bookid.desc()
+            )
+            .limit(per_page + 1)
+            .all()
+        )
+        has_more = len(books) > per_page
+        books = books[:per_page]
+        prev_cursor = encode_cursor(books[0]) if after and books else None
+        next_cursor = encode_cursor(books[-1]) if has_more else None
+    return BooksPage(books, prev_cursor, next_cursor, per_page)
+
+
+def sections_by_book_count():
+    book_count = func.count(Book.bookid).label("book_count")
+    return (
+        db.session.query(Section, book_count)
+        .outerjoin(Book, Book.sectionid == Section.sectionid)
+        .group_by(Section.sectionid)
+        .order_by(book_count.desc(), Section.date_created.desc())
+        .all()
+    )
+
+
+@catalog_cache.cached
+def sorted_sections():
+    return [record(section) for section, book_count in sections_by_book_count()]
+
+
+@catalog_cache.cached
+def sorted_sections_with_books():
+    position = (
+        func.row_number()
+        .over(
+            partition_by=Book.sectionid,
+            order_by=(
+                Book.rating_sum.desc(),
+                Book.date_created.desc(),
+                Book.bookid.desc(),
+            ),
+        )
+        .label("position")
+    )
+    ranked = db.session.query(Book.bookid, position).subquery()
+    section_books = {}
+    for book in (
+        Book.query.join(ranked, ranked.c.bookid == Book.bookid)
+        .filter(ranked.c.position <= current_app.config["BOOKS_PER_SECTION"])
+        .order_by(Book.sectionid, ranked.c.position)
+    ):
+        section_books.setdefault(book.sectionid, []).append(record(book))
+    return [
+        (record(section), section_books.get(section.sectionid, []), book_count)
+        for section, book_count in sections_by_book_count()
+    ]
+
+
+@catalog_cache.cached
+def section_books_page(sectionid, per_page=None, after=None, before=None):
+    section = db.session.get(Section, sectionid)
+    if section is None:
+        return None
+    page = paginate_books(
+        Book.query.filter_by(sectionid=sectionid), per_page, after, before
+    )
+    return SectionBooks(
+        record(section), page._replace(books=[record(book) for book in page.books])
+    )
+
+
+@catalog_cache.cached
+def book_details(bookid):
+    book = Book.query.options(joinedload(Book.section)).filter_by(bookid=bookid).first()
+    if book is None:
+        return None
+    feedbacks = (
+        Feedback.query.filter_by(bookid=bookid)
+        .options(joinedload(Feedback.user))
+        .order_by(Feedback.rating.desc(), Feedback.date_created.desc())
+        .all()
+    )
+    return BookDetails(
+        record(book, section=record(book.section)),
+        [
+            record(feedback, user=record(feedback.user, FEEDBACK_USER_FIELDS))
+            for feedback in feedbacks
+        ],
+    )
+
+
+@catalog_cache.cached
+def catalog_last_modified(sectionid=None):
+    book_dates = db.session.query(func.max(Book.date_created))
+    section_dates = db.session.query(func.max(Section.date_created))
+    if sectionid is not None:
+        book_dates = book_dates.filter(Book.sectionid == sectionid)
+        section_dates = section_dates.filter(Section.sectionid == sectionid)
+    dates = [
+        value
+        for value in (book_dates.scalar(), section_dates.scalar())
+        if value is not None
+    ]
+    if not dates:
+        return None
+    latest = max(dates)
+    return datetime(latest.year, latest.month, latest.day, tzinfo=timezone.utc)
+
+
+def book_last_modified(bookid):
+    details = book_details(bookid)
+    if details is None:
+        return None
+    created = details.book.date_created
+    return datetime(created.year, created.month, created.day, tzinfo=timezone.utc)
+
+
+def search_books(search_term, mode, page):
+    if mode not in SEARCH_MODES:
+        mode = "catalog"
+    page = max(1, page)
+    per_page = current_app.config["SEARCH_RESULTS_PER_PAGE"]
+    if mode == "content":
+        results = search_book_pages(search_term, page, per_page)
+        return CatalogSearch(mode, results, [], results.books)
+    if mode == "fuzzy":
+        results = search_fuzzy(
+            search_term, page, per_page, current_app.config["FUZZY_SEARCH_THRESHOLD"]
+        )
+    else:
+        results = search_catalog(search_term, page, per_page)
+    return CatalogSearch(mode, results, results.sections, results.books)
@@ -0,0 +1,120 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+CHART_COLORS = ("#1f77b4", "#aec7e8", "#ff7f0e", "#ffbb78", "#2ca02c")
+
+
+def bar_figure(counts):
+    figure = Figure(figsize=(10, 6))
+    axes = figure.subplots()
+    axes.bar(
+        [section for section, count in counts],
+        [count for section, count in counts],
+        color=list(CHART_COLORS[: len(counts)]),
+        width=max(0.4, 1.6 / max(1, len(counts))),
+        alpha=0.8,
+    )
+    axes.set_xlabel("Section")
+    axes.set_ylabel("Frequency")
+    axes.tick_params(axis="x", labelrotation=45)
+    figure.tight_layout()
+    return figure
+
+
+def pie_figure(counts):
+    figure = Figure(figsize=(7, 7))
+    axes = figure.subplots()
+    issued = [index for index, (section, count) in enumerate(counts) if count]
+    if issued:
+        axes.pie(
+            [counts[index][1] for index in issued],
+            labels=[counts[index][0] for index in issued],
+            colors=[CHART_COLORS[index] for index in issued],
+            autopct="%1.1f%%",
+            startangle=140,
+            pctdistance=0.85,
+            explode=[0.02] * len(issued),
+            wedgeprops=dict(width=0.3),
+        )
+        axes.axis("equal")
+        figure.tight_layout()
+        axes.legend(title="Sections", loc="upper right")
+    else:
+        axes.text(0.5, 0.5, "No books issued yet", ha="center", va="center")
+        axes.axis("off")
+    return figure
+
+
+def save_figure(figure, path):
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        FigureCanvasAgg(figure).print_png(temporary)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def render_charts(counts, paths):
+    save_figure(bar_figure(counts), paths["bar"])
+    save_figure(pie_figure(counts), paths["pie"])
+
+
+class ChartRenderer:
+    def __init__(self):
+        self.processes = 2
+        self.max_tasks = 50
+        self.timeout = 60
+        self.slots = threading.BoundedSemaphore(8)
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.processes = app.config["STATS_RENDER_PROCESSES"]
+        self.max_tasks = app.config["STATS_RENDER_MAX_TASKS"]
+        self.timeout = app.config["STATS_RENDER_TIMEOUT"]
+        self.slots = threading.BoundedSemaphore(app.config["STATS_RENDER_QUEUE"])
+
+    def executor(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_tasks,
+                )
+            return self.pool
+
+    def discard(self, pool):
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, counts, paths):
+        counts = [tuple(section) for section in counts]
+        if not self.processes:
+            return render_charts(counts, paths)
+        if not self.slots.acquire(timeout=self.timeout):
+            raise RuntimeError("The chart render queue is full")
+        pool = self.executor()
+        try:
+            future = pool.submit(render_charts, counts, paths)
+        except BaseException:
+            self.slots.release()
+            self.discard(pool)
+            raise
+        future.add_done_callback(lambda done: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            self.discard(pool)
+            raise
+
+
+chart_renderer = ChartRenderer()
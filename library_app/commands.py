@@ -0,0 +1,208 @@
+import os
+import click
+from PIL import Image
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, case
+from library_app import db
+from library_app.models import Book, Feedback, BookPage, Job
+from library_app.search import rebuild_search_index, index_book_pages
+from library_app.cache import catalog_cache
+from library_app.pdfs import pdf_delivery, pdf_info
+from library_app.jobs import job_queue
+from library_app.blobs import blob_store
+from library_app.assets import VARIANT_NAME, variant_name
+from library_app.utils import PICTURE_FOLDERS, save_picture_variants
+
+
+@click.command("backfill-ratings")
+@with_appcontext
+def backfill_ratings():
+    """Recompute the rating aggregates stored on every book."""
+    columns = [
+        func.sum(Feedback.rating),
+        func.count(Feedback.feedbackid),
+    ] + [func.sum(case((Feedback.rating == star, 1), else_=0)) for star in range(1, 6)]
+    aggregates = {
+        row[0]: row[1:]
+        for row in db.session.query(Feedback.bookid, *columns)
+        .group_by(Feedback.bookid)
+        .all()
+    }
+    updates = []
+    for (bookid,) in db.session.query(Book.bookid).all():
+        rating_sum, rating_count, *histogram = aggregates.get(bookid, (0,) * 7)
+        update = {
+            "bookid": bookid,
+            "rating_sum": rating_sum,
+            "rating_count": rating_count,
+            "rating_avg": rating_sum / rating_count if rating_count else 0.0,
+        }
+        for star, count in enumerate(histogram, start=1):
+            update[f"rating_{star}"] = count
+        updates.append(update)
+    db.session.bulk_update_mappings(Book, updates)
+    db.session.commit()
+    catalog_cache.invalidate()
+    click.echo(f"Backfilled rating aggregates for {len(updates)} books.")
+
+
+@click.command("rebuild-search")
+@with_appcontext
+def rebuild_search():
+    """Repopulate the full-text and fuzzy catalog search indexes."""
+    rebuild_search_index()
+    click.echo("Rebuilt the catalog search indexes.")
+
+
+@click.command("index-pdfs")
+@click.option("--reindex", is_flag=True, help="Also re-extract books already indexed.")
+@with_appcontext
+def index_pdfs(reindex):
+    """Extract the page text of every book PDF into the content search index."""
+    indexed = {bookid for (bookid,) in db.session.query(BookPage.bookid).distinct()}
+    books = Book.query.filter(Book.pdf_file != "sample_pdf.pdf").all()
+    count = 0
+    for book in books:
+        if book.bookid in indexed and not reindex:
+            continue
+        try:
+            index_book_pages(book)
+            count += 1
+        except (RuntimeError, OSError) as e:
+            db.session.rollback()
+            click.echo(f"Skipped {book.title}: {e}")
+    click.echo(f"Indexed the pages of {count} books.")
+
+
+@click.command("backfill-pdfs")
+@with_appcontext
+def backfill_pdfs():
+    """Record the page count, size and hash of each untracked book PDF."""
+    count = 0
+    for book in Book.query.filter(Book.pdf_hash.is_(None)).all():
+        try:
+            book.set_pdf(pdf_info(book.pdf_file, pdf_delivery.path(book)))
+            count += 1
+        except (RuntimeError, OSError) as e:
+            click.echo(f"Skipped {book.title}: {e}")
+    db.session.commit()
+    click.echo(f"Recorded the PDF details of {count} books.")
+
+
+@click.command("run-jobs")
+@click.option("--workers", default=1, show_default=True, help="Worker threads to run.")
+@click.option("--burst", is_flag=True, help="Exit once the queue is empty.")
+@with_appcontext
+def run_jobs(workers, burst):
+    """Process queued background jobs."""
+    if burst:
+        click.echo(f"Processed {job_queue.drain()} jobs.")
+        return
+    click.echo(f"Processing jobs with {workers} workers. Press CTRL+C to quit.")
+    job_queue.start(workers)
+    job_queue.join()
+
+
+@click.command("job-status")
+@click.option("--failed", is_flag=True, help="List the jobs that failed.")
+@with_appcontext
+def job_status(failed):
+    """Show how many background jobs are in each state."""
+    counts = (
+        db.session.query(Job.name, Job.status, func.count(Job.jobid))
+        .group_by(Job.name, Job.status)
+        .order_by(Job.name, Job.status)
+        .all()
+    )
+    for name, status, count in counts:
+        click.echo(f"{name:<28} {status:<8} {count}")
+    if failed:
+        for job in Job.query.filter_by(status="failed").order_by(Job.jobid):
+            click.echo(f"#{job.jobid} {job.name} ({job.subject}): {job.error}")
+
+
+@click.command("build-picture-variants")
+@click.option("--rebuild", is_flag=True, help="Also regenerate existing variants.")
+@with_appcontext
+def build_picture_variants(rebuild):
+    """Generate the responsive WebP sizes of every uploaded picture."""
+    widths = current_app.config["PICTURE_WIDTHS"]
+    count = 0
+    for folder in PICTURE_FOLDERS.values():
+        folder_path = os.path.join(current_app.static_folder, folder)
+        for root, dirs, files in os.walk(folder_path):
+            for name in files:
+                path = os.path.join(root, name)
+                if VARIANT_NAME.search(name) or name.endswith(".tmp"):
+                    continue
+                if not rebuild and os.path.exists(variant_name(path, min(widths))):
+                    continue
+                for width in widths:
+                    if os.path.exists(variant_name(path, width)):
+                        os.remove(variant_name(path, width))
+                try:
+                    with Image.open(path) as picture:
+                        picture.draft("RGB", (max(widths),) * 2)
+                        save_picture_variants(picture, path, widths)
+                    count += 1
+                except OSError as e:
+                    click.echo(f"Skipped {folder}/{name}: {e}")
+    click.echo(f"Built responsive variants for {count} pictures.")
+
+
+@click.command("migrate-blobs")
+@click.option("--workers", default=8, show_default=True, help="Files to move at once.")
+@with_appcontext
+def migrate_blobs(workers):
+    """Move uploaded files into the sharded blob storage layout."""
+    moved = blob_store.migrate(workers, echo=click.echo)
+    catalog_cache.invalidate()
+    backend = current_app.config["BLOB_BACKEND"]
+    click.echo(f"Moved {moved} files into {backend} blob storage.")
+
+
+@click.command("collect-orphans")
+@click.option(
+    "--min-age",
+    default=24.0,
+    show_default=True,
+    help="Hours a file must be unreferenced before it is removed.",
+)
+@click.option("--max-files", type=int, help="Files to scan before pausing.")
+@click.option("--quarantine", is_flag=True, help="Move orphans to instance/quarantine.")
+@click.option("--dry-run", is_flag=True, help="Only report what would be removed.")
+@click.option("--restart", is_flag=True, help="Scan from the start again.")
+@with_appcontext
+def collect_orphans(min_age, max_files, quarantine, dry_run, restart):
+    """Remove uploaded files that no book, section or user refers to."""
+    cursor_path = os.path.join(current_app.instance_path, "orphans.cursor")
+    after = None
+    if not restart and os.path.exists(cursor_path):
+        with open(cursor_path) as cursor_file:
+            after = cursor_file.read().strip() or None
+    report = blob_store.collect_orphans(
+        min_age * 3600,
+        max_files,
+        after,
+        os.path.join(current_app.instance_path, "quarantine") if quarantine else None,
+        dry_run,
+    )
+    if not dry_run:
+        if report.cursor is not None:
+            with open(cursor_path, "w") as cursor_file:
+                cursor_file.write(report.cursor)
+        elif os.path.exists(cursor_path):
+            os.remove(cursor_path)
+    if dry_run:
+        action = "Would reclaim"
+    elif quarantine:
+        action = "Quarantined"
+    else:
+        action = "Reclaimed"
+    click.echo(
+        f"Scanned {report.scanned} files and found {report.orphans} orphans. "
+        f"{action} {report.reclaimed} bytes ({report.reclaimed / 1024 / 1024:.1f} MB)."
+    )
+    if report.cursor is not None:
+        click.echo(f"Stopped after {report.cursor}; run again to continue.")
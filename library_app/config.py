@@ -12,4 +12,60 @@ class Config:
     MAIL_PORT = os.environ.get("MAIL_PORT")
     MAIL_USE_TLS = os.environ.get("MAIL_USE_TLS")
     MAIL_USERNAME = b64decode(os.environ.get("MAIL_USERNAME")).decode("utf-8")
-    MAIL_PASSWORD = b64decode(os.environ.get("MAIL_PASSWORD") + "==").decode("utf-8")
\ No newline at end of file
+    MAIL_PASSWORD = b64decode(os.environ.get("MAIL_PASSWORD") + "==").decode("utf-8")
+    BOOKS_PER_PAGE = int(os.environ.get("BOOKS_PER_PAGE", 24))
+    MAX_BOOKS_PER_PAGE = int(os.environ.get("MAX_BOOKS_PER_PAGE", 96))
+    BOOKS_PER_SECTION = int(os.environ.get("BOOKS_PER_SECTION", 12))
+    SEARCH_RESULTS_PER_PAGE = int(os.environ.get("SEARCH_RESULTS_PER_PAGE", 20))
+    FUZZY_SEARCH_THRESHOLD = float(os.environ.get("FUZZY_SEARCH_THRESHOLD", 0.45))
+    CATALOG_CACHE_BACKEND = os.environ.get("CATALOG_CACHE_BACKEND", "local")
+    CATALOG_CACHE_SIZE = int(os.environ.get("CATALOG_CACHE_SIZE", 512))
+    CATALOG_CACHE_TTL = int(os.environ.get("CATALOG_CACHE_TTL", 300))
+    FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", 4096))
+    FRAGMENT_CACHE_TTL = int(os.environ.get("FRAGMENT_CACHE_TTL", 300))
+    PAGE_CACHE_MAX_BYTES = int(
+        os.environ.get("PAGE_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+    )
+    ASSET_MAX_AGE = int(os.environ.get("ASSET_MAX_AGE", 31536000))
+    PICTURE_WIDTHS = [
+        int(width)
+        for width in os.environ.get("PICTURE_WIDTHS", "160,320,480").split(",")
+    ]
+    IMAGE_WIDTHS = [
+        int(width)
+        for width in os.environ.get("IMAGE_WIDTHS", "96,160,320,480,640,960").split(",")
+    ]
+    IMAGE_CACHE_FOLDER = os.environ.get("IMAGE_CACHE_FOLDER")
+    IMAGE_CACHE_MAX_BYTES = int(
+        os.environ.get("IMAGE_CACHE_MAX_BYTES", 128 * 1024 * 1024)
+    )
+    BLOB_BACKEND = os.environ.get("BLOB_BACKEND", "local")
+    BLOB_S3_BUCKET = os.environ.get("BLOB_S3_BUCKET")
+    BLOB_S3_PREFIX = os.environ.get("BLOB_S3_PREFIX", "")
+    BLOB_S3_ENDPOINT_URL = os.environ.get("BLOB_S3_ENDPOINT_URL")
+    BLOB_S3_PUBLIC_URL = os.environ.get("BLOB_S3_PUBLIC_URL", "")
+    BLOB_CACHE_FOLDER = os.environ.get("BLOB_CACHE_FOLDER")
+    BLOB_CACHE_MAX_BYTES = int(
+        os.environ.get("BLOB_CACHE_MAX_BYTES", 1024 * 1024 * 1024)
+    )
+    PDF_SENDFILE = os.environ.get("PDF_SENDFILE", "")
+    PDF_ACCEL_PREFIX = os.environ.get("PDF_ACCEL_PREFIX", "/protected/pdfs/")
+    PDF_MAX_AGE = int(os.environ.get("PDF_MAX_AGE", 3600))
+    PDF_PAGE_CACHE_FOLDER = os.environ.get("PDF_PAGE_CACHE_FOLDER")
+    PDF_PAGE_CACHE_MAX_BYTES = int(
+        os.environ.get("PDF_PAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+    )
+    PDF_PAGE_WIDTHS = [
+        int(width)
+        for width in os.environ.get("PDF_PAGE_WIDTHS", "480,800,1200,1600").split(",")
+    ]
+    JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+    JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+    JOB_RETRY_DELAY = int(os.environ.get("JOB_RETRY_DELAY", 10))
+    JOB_LEASE = int(os.environ.get("JOB_LEASE", 300))
+    JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 2.0))
+    STATS_CHART_MAX_AGE = int(os.environ.get("STATS_CHART_MAX_AGE", 60))
+    STATS_RENDER_PROCESSES = int(os.environ.get("STATS_RENDER_PROCESSES", 2))
+    STATS_RENDER_QUEUE = int(os.environ.get("STATS_RENDER_QUEUE", 8))
+    STATS_RENDER_TIMEOUT = int(os.environ.get("STATS_RENDER_TIMEOUT", 60))
+    STATS_RENDER_MAX_TASKS = int(os.environ.get("STATS_RENDER_MAX_TASKS", 50))
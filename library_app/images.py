@@ -0,0 +1,107 @@
+import os
+from flask import url_for, send_file, request, abort
+from PIL import Image
+from werkzeug.security import safe_join
+from library_app.assets import asset_pipeline, blob_digest
+from library_app.blobs import blob_store
+from library_app.cache import DiskCache
+from library_app.utils import PICTURE_FOLDERS, convert_picture, resize_picture
+
+IMAGE_FORMATS = {"webp": "WEBP", "jpeg": "JPEG", "png": "PNG"}
+
+
+class ImageResizer:
+    def __init__(self):
+        self.derivatives = None
+        self.widths = (96, 160, 320, 480, 640, 960)
+        self.max_age = 31536000
+
+    def init_app(self, app):
+        self.derivatives = DiskCache(
+            app.config["IMAGE_CACHE_FOLDER"]
+            or os.path.join(app.instance_path, "images"),
+            app.config["IMAGE_CACHE_MAX_BYTES"],
+        )
+        self.widths = tuple(sorted(app.config["IMAGE_WIDTHS"]))
+        self.max_age = app.config["ASSET_MAX_AGE"]
+        app.add_url_rule(
+            "/images/<kind>/<int:width>/<image_format>/<path:filename>",
+            "images",
+            self.serve,
+            methods=["GET"],
+        )
+        app.add_template_global(self.url, "image_url")
+
+    def url(self, kind, filename, width, image_format="webp"):
+        return url_for(
+            "images",
+            kind=kind,
+            width=width,
+            image_format=image_format,
+            filename=filename,
+            v=self.digest(kind, filename),
+        )
+
+    def digest(self, kind, filename):
+        source = f"{PICTURE_FOLDERS[kind]}/{filename}"
+        return asset_pipeline.digest(source) or blob_digest(source)
+
+    def render(self, source, digest, width, image_format):
+        path = self.derivatives.path(digest[:2], f"{digest}-{width}.{image_format}")
+        if self.derivatives.hit(path):
+            return path
+        if image_format == "webp":
+            options = {"quality": 80, "method": 4}
+        elif image_format == "jpeg":
+            options = {"quality": 85, "optimize": True, "progressive": True}
+        else:
+            options = {"optimize": True}
+        with Image.open(source) as picture:
+            picture.draft("RGB", (width, width))
+            variant = resize_picture(
+                convert_picture(picture, alpha=image_format != "jpeg"), width
+            )
+            return self.derivatives.store(
+                path,
+                lambda target: variant.save(
+                    target, IMAGE_FORMATS[image_format], **options
+                ),
+            )
+
+    def serve(self, kind, width, image_format, filename):
+        if (
+            kind not in PICTURE_FOLDERS
+            or width not in self.widths
+            or image_format not in IMAGE_FORMATS
+        ):
+            abort(404)
+        folder = PICTURE_FOLDERS[kind]
+        if safe_join(asset_pipeline.static_folder, folder, filename) is None:
+            abort(404)
+        digest = self.digest(kind, filename)
+        if digest is None:
+            abort(404)
+        try:
+            path = self.render(
+                blob_store.path(folder, filename),
+                digest,
+                width,
+                image_format,
+            )
+        except OSError:
+            abort(404)
+        current = request.args.get("v") == digest
+        response = send_file(
+            path,
+            mimetype=f"image/{image_format}",
+            conditional=True,
+            etag=f"{digest}-{width}-{image_format}",
+            max_age=self.max_age if current else 0,
+        )
+        if current:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        return response
+
+
+image_resizer = ImageResizer()
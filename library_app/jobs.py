@@ -0,0 +1,151 @@
+import json
+import threading
+from datetime import datetime, timezone, timedelta
+from library_app import db
+from library_app.models import Job
+
+PENDING_STATUSES = ("queued", "running")
+
+
+class JobQueue:
+    def __init__(self):
+        self.tasks = {}
+        self.app = None
+        self.workers = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.worker_count = 2
+        self.max_attempts = 3
+        self.retry_delay = 10
+        self.lease = 300
+        self.poll_interval = 2.0
+
+    def init_app(self, app):
+        self.app = app
+        self.worker_count = app.config["JOB_WORKERS"]
+        self.max_attempts = app.config["JOB_MAX_ATTEMPTS"]
+        self.retry_delay = app.config["JOB_RETRY_DELAY"]
+        self.lease = app.config["JOB_LEASE"]
+        self.poll_interval = app.config["JOB_POLL_INTERVAL"]
+
+    def task(self, name):
+        def register(fn):
+            self.tasks[name] = fn
+            return fn
+
+        return register
+
+    def enqueue(self, name, payload, subject=None):
+        if name not in self.tasks:
+            raise LookupError(f"Unknown job {name!r}")
+        job = Job(name, json.dumps(payload), subject)
+        db.session.add(job)
+        db.session.commit()
+        if self.worker_count:
+            self.start(self.worker_count)
+        self.wakeup.set()
+        return job
+
+    def latest(self, subject):
+        return Job.query.filter_by(subject=subject).order_by(Job.jobid.desc()).first()
+
+    def pending(self, subject):
+        return (
+            Job.query.filter(
+                Job.subject == subject, Job.status.in_(PENDING_STATUSES)
+            ).first()
+            is not None
+        )
+
+    def claim(self):
+        now = datetime.now(timezone.utc)
+        ready = (Job.status.in_(PENDING_STATUSES), Job.run_after <= now)
+        while True:
+            candidate = (
+                db.session.query(Job.jobid)
+                .filter(*ready)
+                .order_by(Job.run_after, Job.jobid)
+                .first()
+            )
+            if candidate is None:
+                return None
+            claimed = (
+                Job.query.filter(Job.jobid == candidate.jobid, *ready).update(
+                    {
+                        "status": "running",
+                        "attempts": Job.attempts + 1,
+                        "run_after": now + timedelta(seconds=self.lease),
+                    },
+                    synchronize_session=False,
+                )
+            )
+            db.session.commit()
+            if claimed:
+                return db.session.get(Job, candidate.jobid, populate_existing=True)
+
+    def run(self, job):
+        jobid = job.jobid
+        try:
+            if job.name not in self.tasks:
+                raise LookupError(f"Unknown job {job.name!r}")
+            self.tasks[job.name](**json.loads(job.payload))
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.exception("Job %s (%s) failed", jobid, job.name)
+            job = db.session.get(Job, jobid, populate_existing=True)
+            job.error = f"{type(e).__name__}: {e}"
+            if job.attempts < self.max_attempts:
+                job.status = "queued"
+                job.run_after = datetime.now(timezone.utc) + timedelta(
+                    seconds=self.retry_delay * 2 ** (job.attempts - 1)
+                )
+            else:
+                job.status = "failed"
+        else:
+            job = db.session.get(Job, jobid, populate_existing=True)
+            job.status = "done"
+            job.error = None
+        db.session.commit()
+        return job
+
+    def work_once(self):
+        with self.app.app_context():
+            job = self.claim()
+            if job is None:
+                return None
+            return self.run(job)
+
+    def drain(self):
+        count = 0
+        while self.work_once() is not None:
+            count += 1
+        return count
+
+    def work(self):
+        while True:
+            try:
+                job = self.work_once()
+            except Exception:
+                self.app.logger.exception("Job worker error")
+                job = None
+            if job is None:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+
+    def start(self, count):
+        with self.lock:
+            if self.workers:
+                return
+            for number in range(count):
+                worker = threading.Thread(
+                    target=self.work, name=f"job-worker-{number}", daemon=True
+                )
+                worker.start()
+                self.workers.append(worker)
+
+    def join(self):
+        for worker in self.workers:
+            worker.join()
+
+
+job_queue = JobQueue()
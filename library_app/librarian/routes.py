@@ -10,16 +10,39 @@ from flask import (
     Blueprint,
 )
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, selectinload
 from flask_login import login_user, current_user, logout_user
 from library_app import db, bcrypt
 from library_app.models import User, Section, Book, Request, IssuedBook
+from library_app.search import index_book_pages, index_book_trigrams
+from library_app.autocomplete import autocomplete_index
+from library_app.cache import catalog_cache, conditional
+from library_app.catalog import (
+    sorted_sections,
+    sorted_sections_with_books,
+    section_books_page,
+    book_details,
+    search_books,
+    catalog_last_modified,
+    book_last_modified,
+)
 from library_app.utils import (
     login_required,
     save_picture,
     send_reset_email,
     delete_file,
 )
-from library_app.librarian.utils import save_pdf, generate_plots
+from library_app.librarian.utils import queue_book_uploads, book_info_state
+from library_app.pdfs import PdfInfo, pdf_delivery, pdf_pages
+from library_app.stats import (
+    CHART_NAMES,
+    user_section_counts,
+    counts_digest,
+    counts_response,
+    chart_response,
+    refresh_chart_pngs,
+)
+from library_app.jobs import job_queue
 from library_app.forms import (
     LoginForm,
     EditProfileForm,
@@ -87,6 +110,8 @@ def add_section():
         )
         db.session.add(section)
         db.session.commit()
+        autocomplete_index.add_section(section)
+        catalog_cache.invalidate()
         flash(f"New Section {form.title.data} created!", "success")
         return redirect(url_for("librarian.sections"))
     return render_template(
@@ -125,6 +150,8 @@ def edit_section(sectionid):
         section.title = form.title.data
         section.description = form.description.data
         db.session.commit()
+        autocomplete_index.add_section(section)
+        catalog_cache.invalidate()
         return redirect(url_for("librarian.section_books", sectionid=sectionid))
     if request.method == "GET":
         form.title.data = section.title
@@ -149,11 +176,12 @@ def delete_section(sectionid):
         try:
             if section.picture != "default_section_picture.jpeg":
                 delete_file("section", section.picture)
-            for book in section.books:
-                book.sectionid = 1
+            Book.query.filter_by(sectionid=sectionid).update({"sectionid": 1})
             db.session.commit()
             db.session.delete(section)
             db.session.commit()
+            autocomplete_index.remove_section(sectionid)
+            catalog_cache.invalidate()
             flash("Section deleted successfully.", "success")
         except Exception:
             db.session.rollback()
@@ -167,31 +195,34 @@ def delete_section(sectionid):
 @login_required(role="librarian")
 def search():
     if request.method == "POST":
-        search_term = request.form["search_term"]
-        sections = (
-            Section.query.filter(Section.title.ilike(f"%{search_term}%"))
-            .order_by(Section.date_created.desc())
-            .all()
-        )
-        books = Book.query.filter(Book.title.ilike(f"%{search_term}%")).all()
-        authors = Book.query.filter(Book.author.ilike(f"%{search_term}%")).all()
-        return render_template(
-            "librarian/search.html",
-            title="Search",
-            librarian=current_user,
-            sections=sections,
-            books=books,
-            authors=authors,
+        return redirect(
+            url_for("librarian.search", search_term=request.form["search_term"])
         )
-    else:
+    search_term = request.args.get("search_term", "").strip()
+    if not search_term:
         return redirect(url_for("librarian.books"))
+    catalog_search = search_books(
+        search_term,
+        request.args.get("mode", "catalog"),
+        request.args.get("page", 1, type=int),
+    )
+    return render_template(
+        "librarian/search.html",
+        title="Search",
+        librarian=current_user,
+        search_term=search_term,
+        mode=catalog_search.mode,
+        results=catalog_search.results,
+        sections=catalog_search.sections,
+        books=catalog_search.books,
+    )
 
 
 @librarian.route("/librarian/sections")
 @login_required(role="librarian")
+@conditional(catalog_last_modified)
 def sections():
-    sections = Section.query.order_by(Section.date_created.desc()).all()
-    sections.sort(key=lambda x: len(x.books), reverse=True)
+    sections = list(sorted_sections())
     sections.append(None)
     return render_template(
         "librarian/sections.html",
@@ -204,16 +235,18 @@ def sections():
 
 @librarian.route("/librarian/section-books/<int:sectionid>")
 @login_required(role="librarian")
+@conditional(catalog_last_modified)
 def section_books(sectionid):
-    section = Section.query.get(sectionid)
-    sorted_books = sorted(
-        section.books,
-        key=lambda x: (
-            sum(feedback.rating for feedback in x.feedbacks),
-            x.date_created,
-        ),
-        reverse=True,
+    listing = section_books_page(
+        sectionid,
+        per_page=request.args.get("per_page", type=int),
+        after=request.args.get("after"),
+        before=request.args.get("before"),
     )
+    if listing is None:
+        abort(404)
+    section, page = listing
+    sorted_books = list(page.books)
     sorted_books.append(None)
     return render_template(
         "librarian/section_books.html",
@@ -222,6 +255,7 @@ def section_books(sectionid):
         navbaractive=["Books"],
         section=section,
         sorted_books=sorted_books,
+        page=page,
     )
 
 
@@ -230,25 +264,22 @@ def section_books(sectionid):
 def add_book(sectionid):
     form = AddBookForm()
     if form.validate_on_submit():
-        if form.picture.data:
-            picture = save_picture(form.picture.data, "book\\pictures")
-        else:
-            picture = "default_book_picture.png"
-        if form.pdf_file.data:
-            pdf_file = save_pdf(form.pdf_file.data, "book\\pdfs")
-        else:
-            pdf_file = "sample_pdf.pdf"
         book = Book(
             title=form.title.data,
             author=form.author.data,
-            picture=picture,
+            picture="default_book_picture.png",
             description=form.description.data,
             sectionid=sectionid,
-            pdf_file=pdf_file,
         )
+        book.set_pdf(PdfInfo("sample_pdf.pdf"))
         db.session.add(book)
         db.session.commit()
+        index_book_trigrams(book)
+        autocomplete_index.add_book(book)
+        catalog_cache.invalidate()
         flash(f"New Book {form.title.data} created!", "success")
+        if queue_book_uploads(book, form):
+            flash("The book's files are being processed.", "info")
         return redirect(url_for("librarian.section_books", sectionid=sectionid))
     if request.method == "GET":
         form.sectionid.data = sectionid
@@ -274,33 +305,32 @@ def edit_book(bookid):
             or book.title != form.title.data
             or book.author != form.author.data
             or book.description != form.description.data
-            or book.sectionid != book.sectionid.data
+            or book.sectionid != form.sectionid.data
         ):
             book.date_created = datetime.now(timezone.utc).date()
             db.session.commit()
             flash("Book has been updated!", "success")
-        if form.picture.data:
-            if book.picture != "default_book_picture.png":
-                delete_file("book\\pictures", book.picture)
-            book.picture = save_picture(form.picture.data, "book\\pictures")
-        elif form.delete_picture.data == "yes":
+        if form.delete_picture.data == "yes" and not form.picture.data:
             if book.picture != "default_book_picture.png":
-                delete_file("book\\pictures", book.picture)
+                delete_file("book/pictures", book.picture)
             book.picture = "default_book_picture.png"
-        if form.pdf_file.data:
+        if form.delete_pdf_file.data == "yes" and not form.pdf_file.data:
             if book.pdf_file != "sample_pdf.pdf":
-                delete_file("book\\pdfs", book.pdf_file)
-            book.pdf_file = save_pdf(form.pdf_file.data, "book\\pdfs")
-        elif form.delete_pdf_file.data == "yes":
-            if book.picture != "sample_pdf.pdf":
-                delete_file("book\\pdfs", book.pdf_file)
-            book.picture = "sample_pdf.pdf"
+                delete_file("book/pdfs", book.pdf_file)
+            book.set_pdf(PdfInfo("sample_pdf.pdf"))
         book.title = form.title.data
         book.author = form.author.data
         book.description = form.description.data
         book.sectionid = form.sectionid.data
         db.session.commit()
-        return redirect(url_for("librarian.section_book", sectionid=book.sectionid))
+        index_book_trigrams(book)
+        autocomplete_index.add_book(book)
+        catalog_cache.invalidate()
+        if form.delete_pdf_file.data == "yes" and not form.pdf_file.data:
+            index_book_pages(book)
+        if queue_book_uploads(book, form):
+            flash("The book's files are being processed.", "info")
+        return redirect(url_for("librarian.section_books", sectionid=book.sectionid))
     if request.method == "GET":
         form.title.data = book.title
         form.author.data = book.author
@@ -324,11 +354,13 @@ def delete_book(place, bookid):
         sectionid = book.sectionid
         if book:
             if book.picture != "default_book_picture.png":
-                delete_file("book\\pictures", book.picture)
+                delete_file("book/pictures", book.picture)
             if book.pdf_file != "sample_pdf.pdf":
-                delete_file("book\\pdfs", book.pdf_file)
+                delete_file("book/pdfs", book.pdf_file)
             db.session.delete(book)
             db.session.commit()
+            autocomplete_index.remove_book(bookid)
+            catalog_cache.invalidate()
             flash("The book has been deleted.", "success")
         else:
             flash("Book not found.", "danger")
@@ -343,20 +375,9 @@ def delete_book(place, bookid):
 
 @librarian.route("/librarian/books")
 @login_required(role="librarian")
+@conditional(catalog_last_modified)
 def books():
-    sections = Section.query.order_by(Section.date_created.desc()).all()
-    sections.sort(key=lambda x: len(x.books), reverse=True)
-    sorted_sections = []
-    for section in sections:
-        sorted_books = sorted(
-            section.books,
-            key=lambda x: (
-                sum(feedback.rating for feedback in x.feedbacks),
-                x.date_created,
-            ),
-            reverse=True,
-        )
-        sorted_sections.append((section, sorted_books))
+    sorted_sections = sorted_sections_with_books()
     return render_template(
         "librarian/books.html",
         title="Books",
@@ -368,19 +389,18 @@ def books():
 
 @librarian.route("/librarian/book-info/<int:bookid>")
 @login_required(role="librarian")
+@conditional(book_last_modified, book_info_state)
 def book_info(bookid):
-    book = Book.query.get(bookid)
-    if book is None:
+    details = book_details(bookid)
+    if details is None:
         flash("Book not found", "danger")
-        return redirect(url_for("user.books"))
-    feedbacks = sorted(
-        book.feedbacks, key=lambda x: (x.rating, x.date_created), reverse=True
-    )
-    pdf_file = url_for("static", filename="book/pdfs/" + book.pdf_file)
+        return redirect(url_for("librarian.books"))
+    book, feedbacks = details
     issuedbooks = (
         IssuedBook.query.filter(
             IssuedBook.bookid == bookid, IssuedBook.status == "current"
         )
+        .options(joinedload(IssuedBook.user))
         .order_by(IssuedBook.to_date.desc())
         .all()
     )
@@ -390,11 +410,10 @@ def book_info(bookid):
         title="Books",
         librarian=current_user,
         book=book,
+        processing=job_queue.pending(f"book:{bookid}"),
         issuedbooks=issuedbooks,
         feedbacks=feedbacks,
-        pdf_file=pdf_file,
         navbaractive=["Books"],
-        sections=sections,
     )
 
 
@@ -402,40 +421,69 @@ def book_info(bookid):
 @login_required(role="librarian")
 def view_book(bookid):
     book = Book.query.get(bookid)
-    pdf_file = url_for("static", filename="book/pdfs/" + book.pdf_file)
     return render_template(
         "librarian/view_book.html",
         title="View Book",
         book=book,
+        shape=pdf_pages.shape(book),
         librarian=current_user,
-        pdf_file=pdf_file,
         navbactive=["MyBooks"],
     )
 
 
+@librarian.route("/librarian/book-pdf/<int:bookid>")
+@login_required(role="librarian")
+def book_pdf(bookid):
+    book = Book.query.get(bookid)
+    if book is None:
+        abort(404)
+    return pdf_delivery.send(book)
+
+
+@librarian.route("/librarian/book-page/<int:bookid>/<int:page>")
+@login_required(role="librarian")
+def book_page(bookid, page):
+    book = Book.query.get(bookid)
+    if book is None:
+        abort(404)
+    width = request.args.get("width", 800, type=int)
+    return pdf_pages.send(book, page, width)
+
+
 @librarian.route("/librarian/requests")
 @login_required(role="librarian")
 def requests():
-    outdated_requests = Request.query.filter_by(status="pending").all()
-    for outdated_request in outdated_requests:
-        if ((outdated_request.date_created + timedelta(days=7)) < date.today()):
-            outdated_request.status = "rejected"
+    Request.query.filter(
+        Request.status == "pending",
+        Request.date_created < date.today() - timedelta(days=7),
+    ).update({"status": "rejected"})
+    expired = IssuedBook.query.filter(
+        IssuedBook.status == "current",
+        IssuedBook.to_date < datetime.now(timezone.utc).date(),
+    )
+    User.query.filter(
+        db.or_(
+            User.userid.in_(expired.with_entities(IssuedBook.userid)),
+            User.userid.in_(expired.with_entities(IssuedBook.issued_by)),
+        )
+    ).update({"stats_version": User.stats_version + 1}, synchronize_session=False)
+    expired.update({"status": "returned"})
     db.session.commit()
     requests = (
-        Request.query.filter_by(status="pending").order_by(Request.date_created).all()
+        Request.query.filter_by(status="pending")
+        .options(selectinload(Request.user), selectinload(Request.book))
+        .order_by(Request.date_created)
+        .all()
     )
-    issuedbooks = IssuedBook.query.filter_by(status="current").all()
-    for issuedbook in issuedbooks:
-        if datetime.now(timezone.utc).date() > issuedbook.to_date:
-            issuedbook.status = "returned"
-    db.session.commit()
     rejectedbooks = (
         Request.query.filter_by(status="rejected")
+        .options(selectinload(Request.user), selectinload(Request.book))
         .order_by(Request.date_created.desc())
         .all()
     )
     issuedbooks = (
         IssuedBook.query.filter_by(status="current")
+        .options(selectinload(IssuedBook.user), selectinload(IssuedBook.book))
         .order_by(IssuedBook.to_date.desc())
         .all()
     )
@@ -502,15 +550,31 @@ def revoke_access(issueid):
 @librarian.route("/librarian/stats")
 @login_required(role="librarian")
 def stats():
-    generate_plots()
+    counts = user_section_counts(current_user)
     return render_template(
         "librarian/stats.html",
         title="Stats",
         librarian=current_user,
+        digest=counts_digest(counts),
+        job=refresh_chart_pngs(current_user, counts),
         navbaractive=["Stats"],
     )
 
 
+@librarian.route("/librarian/stats/sections.json")
+@login_required(role="librarian")
+def stats_sections():
+    return counts_response(user_section_counts(current_user))
+
+
+@librarian.route("/librarian/stats/<chart>.svg")
+@login_required(role="librarian")
+def stats_chart(chart):
+    if chart not in CHART_NAMES:
+        abort(404)
+    return chart_response(user_section_counts(current_user), chart)
+
+
 previous_user = None
 
 
@@ -584,15 +648,15 @@ def edit_profile():
             if form.profile_picture.data:
                 if current_user.profile_picture != "default_profile_picture.png":
                     delete_file(
-                        "librarian\\profile_pictures", current_user.profile_picture
+                        "librarian/profile_pictures", current_user.profile_picture
                     )
                 current_user.profile_picture = save_picture(
-                    form.profile_picture.data, "librarian\\profile_pictures"
+                    form.profile_picture.data, "librarian/profile_pictures"
                 )
             elif form.delete_profile_picture.data == "yes":
                 if current_user.profile_picture != "default_profile_picture.png":
                     delete_file(
-                        "librarian\\profile_pictures", current_user.profile_picture
+                        "librarian/profile_pictures", current_user.profile_picture
                     )
                 current_user.profile_picture = "default_profile_picture.png"
             current_user.name = form.name.data
@@ -664,7 +728,7 @@ def delete_account():
         if bcrypt.check_password_hash(current_user.password, form.password.data):
             if current_user.profile_picture != "default_profile_picture.png":
                 delete_file(
-                    "librarin\\profile_pictures", current_user.profile_picture
+                    "librarian/profile_pictures", current_user.profile_picture
                 )
             db.session.delete(current_user)
             db.session.commit()
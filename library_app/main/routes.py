@@ -1,10 +1,31 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import (
+    Blueprint,
+    render_template,
+    redirect,
+    url_for,
+    flash,
+    request,
+    abort,
+    jsonify,
+)
 from flask_login import current_user
 from library_app import db, bcrypt
-from library_app.models import User, Section, Book
+from library_app.models import User, Book
 from library_app.utils import check_user
 from library_app.forms import ResetPasswordForm
 from library_app.main.forms import ResetRequestForm
+from library_app.autocomplete import autocomplete_index
+from library_app.pdfs import pdf_pages
+from library_app.cache import page_cache, conditional
+from library_app.catalog import (
+    sorted_sections,
+    sorted_sections_with_books,
+    section_books_page,
+    book_details,
+    search_books,
+    catalog_last_modified,
+    book_last_modified,
+)
 from library_app.utils import send_reset_email
 
 main = Blueprint("main", __name__)
@@ -14,9 +35,10 @@ main = Blueprint("main", __name__)
 @main.route("/home")
 @main.route("/sections")
 @check_user()
+@conditional(catalog_last_modified)
+@page_cache.cached
 def sections():
-    sections = Section.query.order_by(Section.date_created.desc()).all()
-    sections.sort(key=lambda x: len(x.books), reverse=True)
+    sections = sorted_sections()
     return render_template(
         "main/sections.html",
         title="Sections",
@@ -29,60 +51,87 @@ def sections():
 @check_user()
 def search():
     if request.method == "POST":
-        search_term = request.form["search_term"]
-        sections = (
-            Section.query.filter(Section.title.ilike(f"%{search_term}%"))
-            .order_by(Section.date_created.desc())
-            .all()
+        return redirect(
+            url_for("main.search", search_term=request.form["search_term"])
         )
-        books = Book.query.filter(Book.title.ilike(f"%{search_term}%")).all()
-        authors = Book.query.filter(Book.author.ilike(f"%{search_term}%")).all()
-        return render_template(
-            "main/search.html",
-            title="Search",
-            user=current_user,
-            sections=sections,
-            books=books,
-            authors=authors,
-        )
-    else:
+    search_term = request.args.get("search_term", "").strip()
+    if not search_term:
         return redirect(url_for("main.books"))
+    catalog_search = search_books(
+        search_term,
+        request.args.get("mode", "catalog"),
+        request.args.get("page", 1, type=int),
+    )
+    return render_template(
+        "main/search.html",
+        title="Search",
+        user=current_user,
+        search_term=search_term,
+        mode=catalog_search.mode,
+        results=catalog_search.results,
+        sections=catalog_search.sections,
+        books=catalog_search.books,
+    )
+
+
+@main.route("/book-preview/<int:bookid>")
+def book_preview(bookid):
+    book = Book.query.get(bookid)
+    if book is None:
+        abort(404)
+    width = request.args.get("width", 480, type=int)
+    return pdf_pages.send(book, 1, width, public=True)
+
+
+@main.route("/autocomplete")
+def autocomplete():
+    if current_user.is_authenticated:
+        blueprint = current_user.get_urole()
+    else:
+        blueprint = "main"
+    suggestions = []
+    for kind, entityid, label in autocomplete_index.complete(
+        request.args.get("q", "")
+    ):
+        if kind == "book":
+            url = url_for(f"{blueprint}.book_info", bookid=entityid)
+        else:
+            url = url_for(f"{blueprint}.section_books", sectionid=entityid)
+        suggestions.append({"kind": kind, "label": label, "url": url})
+    return jsonify(suggestions)
 
 
 @main.route("/section-books/<int:sectionid>")
 @check_user()
+@conditional(catalog_last_modified)
+@page_cache.cached
 def section_books(sectionid):
-    section = Section.query.get(sectionid)
-    sorted_books = sorted(
-        section.books,
-        key=lambda x: (sum(feedback.rating for feedback in x.feedbacks), x.date_created),
-        reverse=True,
+    listing = section_books_page(
+        sectionid,
+        per_page=request.args.get("per_page", type=int),
+        after=request.args.get("after"),
+        before=request.args.get("before"),
     )
+    if listing is None:
+        abort(404)
+    section, page = listing
+    sorted_books = page.books
     return render_template(
         "main/section_books.html",
         title=f"{section.title} Books",
         navbaractive=["Books"],
         section=section,
         sorted_books=sorted_books,
+        page=page,
     )
 
 
 @main.route("/books")
 @check_user()
+@conditional(catalog_last_modified)
+@page_cache.cached
 def books():
-    sections = Section.query.order_by(Section.date_created.desc()).all()
-    sections.sort(key=lambda x: len(x.books), reverse=True)
-    sorted_sections = []
-    for section in sections:
-        sorted_books = sorted(
-            section.books,
-            key=lambda x: (
-                sum(feedback.rating for feedback in x.feedbacks),
-                x.date_created,
-            ),
-            reverse=True,
-        )
-        sorted_sections.append((section, sorted_books))
+    sorted_sections = sorted_sections_with_books()
     return render_template(
         "main/books.html",
         title="Books",
@@ -93,23 +142,20 @@ def books():
 
 @main.route("/book-info/<int:bookid>")
 @check_user()
+@conditional(book_last_modified)
+@page_cache.cached
 def book_info(bookid):
-    book = Book.query.get(bookid)
-    if book is None:
+    details = book_details(bookid)
+    if details is None:
         flash("Book not found", "danger")
-        return redirect(url_for("user.books"))
-    feedbacks = sorted(
-        book.feedbacks, key=lambda x: (x.rating, x.date_created), reverse=True
-    )
-    pdf_file = url_for("static", filename="book/pdfs/" + book.pdf_file)
+        return redirect(url_for("main.books"))
+    book, feedbacks = details
     return render_template(
         "main/book_info.html",
         title="Books",
         book=book,
         feedbacks=feedbacks,
-        pdf_file=pdf_file,
         navbaractive=["Books"],
-        sections=sections,
     )
 
 
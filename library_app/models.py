@@ -2,7 +2,7 @@ import jwt
 from datetime import datetime, timedelta, timezone
 from flask import current_app
 from library_app import db, login_manager, bcrypt
-from sqlalchemy import CheckConstraint
+from sqlalchemy import CheckConstraint, case, event
 
 
 @login_manager.user_loader
@@ -18,10 +18,11 @@ class User(db.Model):
     email = db.Column(db.String(60), unique=True, nullable=False)
     password = db.Column(db.String(60), nullable=False)
     profile_picture = db.Column(
-        db.String(20), nullable=False, default="default_profile_picture.png"
+        db.String(80), nullable=False, default="default_profile_picture.png"
     )
     authenticated = db.Column(db.Boolean, default=False)
     urole = db.Column(db.String(20), default="user")
+    stats_version = db.Column(db.Integer, nullable=False, default=0)
     requests = db.relationship(
         "Request", back_populates="user", lazy=True, cascade="all, delete-orphan"
     )
@@ -104,9 +105,14 @@ class Section(db.Model):
         db.Date, nullable=False, default=datetime.now(timezone.utc).date()
     )
     picture = db.Column(
-        db.String(20), nullable=False, default="default_section_picture.jpeg"
+        db.String(80), nullable=False, default="default_section_picture.jpeg"
     )
     description = db.Column(db.String(120), nullable=False)
+    date_updated = db.Column(
+        db.DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
     books = db.relationship("Book", back_populates="section", lazy=True)
 
     def __init__(
@@ -134,13 +140,32 @@ class Book(db.Model):
         db.Date, nullable=False, default=datetime.now(timezone.utc).date()
     )
     picture = db.Column(
-        db.String(20), nullable=False, default="default_book_picture.png"
+        db.String(80), nullable=False, default="default_book_picture.png"
     )
     description = db.Column(db.String(120), nullable=False)
-    pdf_file = db.Column(db.String(20), nullable=False)
+    pdf_file = db.Column(db.String(80), nullable=False)
     sectionid = db.Column(
         db.Integer, db.ForeignKey("section.sectionid"), nullable=False, default=1
     )
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_avg = db.Column(db.Float, nullable=False, default=0.0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+    trigram_count = db.Column(db.Integer, nullable=False, default=0)
+    pdf_page_count = db.Column(db.Integer, nullable=False, default=0)
+    pdf_size = db.Column(db.Integer, nullable=False, default=0)
+    pdf_hash = db.Column(db.String(64))
+    pdf_page_width = db.Column(db.Float, nullable=False, default=0.0)
+    pdf_page_height = db.Column(db.Float, nullable=False, default=0.0)
+    date_updated = db.Column(
+        db.DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
     section = db.relationship("Section", back_populates="books")
     issuedbooks = db.relationship(
         "IssuedBook", back_populates="book", lazy=True, cascade="all, delete-orphan"
@@ -152,6 +177,19 @@ class Book(db.Model):
         "Request", back_populates="book", lazy=True, cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        db.Index(
+            "ix_book_rating", rating_sum.desc(), date_created.desc(), bookid.desc()
+        ),
+        db.Index(
+            "ix_book_section_rating",
+            sectionid,
+            rating_sum.desc(),
+            date_created.desc(),
+            bookid.desc(),
+        ),
+    )
+
     def __init__(
         self,
         title,
@@ -169,6 +207,47 @@ class Book(db.Model):
         self.description = description
         self.pdf_file = pdf_file
         self.sectionid = sectionid
+        self.rating_sum = 0
+        self.rating_count = 0
+        self.rating_avg = 0.0
+        for star in range(1, 6):
+            setattr(self, f"rating_{star}", 0)
+        self.trigram_count = 0
+        self.pdf_page_count = 0
+        self.pdf_size = 0
+        self.pdf_page_width = 0.0
+        self.pdf_page_height = 0.0
+
+    def set_pdf(self, pdf):
+        self.pdf_file = pdf.pdf_file
+        self.pdf_page_count = pdf.page_count
+        self.pdf_size = pdf.size
+        self.pdf_hash = pdf.digest
+        self.pdf_page_width = pdf.page_width
+        self.pdf_page_height = pdf.page_height
+
+    def update_rating(self, old_rating=None, new_rating=None):
+        old_rating = int(old_rating) if old_rating is not None else None
+        new_rating = int(new_rating) if new_rating is not None else None
+        if old_rating == new_rating:
+            return
+        sum_delta = (new_rating or 0) - (old_rating or 0)
+        count_delta = (new_rating is not None) - (old_rating is not None)
+        self.rating_sum = Book.rating_sum + sum_delta
+        self.rating_count = Book.rating_count + count_delta
+        self.rating_avg = case(
+            (
+                Book.rating_count + count_delta > 0,
+                (Book.rating_sum + sum_delta) * 1.0 / (Book.rating_count + count_delta),
+            ),
+            else_=0.0,
+        )
+        if old_rating is not None:
+            column = f"rating_{old_rating}"
+            setattr(self, column, getattr(Book, column) - 1)
+        if new_rating is not None:
+            column = f"rating_{new_rating}"
+            setattr(self, column, getattr(Book, column) + 1)
 
     def __repr__(self):
         return f"Book('{self.bookid}', '{self.title}', '{self.author}', '{self.date_created}', '{self.picture}', '{self.description}', '{self.pdf_file}', '{self.sectionid}')"
@@ -261,6 +340,17 @@ User.issued_books = db.relationship(
 )
 
 
+@event.listens_for(IssuedBook, "after_insert")
+@event.listens_for(IssuedBook, "after_update")
+@event.listens_for(IssuedBook, "after_delete")
+def bump_stats_version(mapper, connection, issuedbook):
+    connection.execute(
+        User.__table__.update()
+        .where(User.userid.in_([issuedbook.userid, issuedbook.issued_by]))
+        .values(stats_version=User.stats_version + 1)
+    )
+
+
 class Feedback(db.Model):
     __tablename__ = "feedback"
     feedbackid = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -294,3 +384,114 @@ class Feedback(db.Model):
 
     def __repr__(self):
         return f"Feedback('{self.feedbackid}', '{self.userid}', '{self.bookid}', '{self.date_created}', '{self.rating}', '{self.content}')"
+
+
+class BookPage(db.Model):
+    __tablename__ = "book_page"
+    pageid = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    bookid = db.Column(
+        db.Integer, db.ForeignKey("book.bookid"), nullable=False, index=True
+    )
+    page_number = db.Column(db.Integer, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+
+    def __init__(self, bookid, page_number, content):
+        self.bookid = bookid
+        self.page_number = page_number
+        self.content = content
+
+    def __repr__(self):
+        return f"BookPage('{self.pageid}', '{self.bookid}', '{self.page_number}')"
+
+
+class BookTrigram(db.Model):
+    __tablename__ = "book_trigram"
+    trigram = db.Column(db.String(3), primary_key=True)
+    bookid = db.Column(
+        db.Integer, db.ForeignKey("book.bookid"), primary_key=True, index=True
+    )
+
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    def __init__(self, trigram, bookid):
+        self.trigram = trigram
+        self.bookid = bookid
+
+    def __repr__(self):
+        return f"BookTrigram('{self.trigram}', '{self.bookid}')"
+
+
+class CatalogVersion(db.Model):
+    __tablename__ = "catalog_version"
+    versionid = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, versionid=1, version=0):
+        self.versionid = versionid
+        self.version = version
+
+    def __repr__(self):
+        return f"CatalogVersion('{self.versionid}', '{self.version}')"
+
+
+class Job(db.Model):
+    __tablename__ = "job"
+    jobid = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(40), nullable=False)
+    subject = db.Column(db.String(60), index=True)
+    payload = db.Column(db.Text, nullable=False, default="{}")
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    run_after = db.Column(
+        db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc)
+    )
+    date_created = db.Column(
+        db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc)
+    )
+    date_updated = db.Column(
+        db.DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+    __table_args__ = (db.Index("ix_job_ready", status, run_after),)
+
+    def __init__(self, name, payload="{}", subject=None):
+        self.name = name
+        self.payload = payload
+        self.subject = subject
+        self.status = "queued"
+        self.attempts = 0
+        self.run_after = datetime.now(timezone.utc)
+
+    def __repr__(self):
+        return f"Job('{self.jobid}', '{self.name}', '{self.status}')"
+
+
+class Blob(db.Model):
+    __tablename__ = "blob"
+    blobid = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    folder = db.Column(db.String(60), nullable=False)
+    filename = db.Column(db.String(80), nullable=False)
+    digest = db.Column(db.String(64), nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=1)
+    date_created = db.Column(
+        db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc)
+    )
+    date_updated = db.Column(
+        db.DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+    __table_args__ = (db.UniqueConstraint(folder, filename),)
+
+    def __init__(self, folder, filename, digest, refcount=1):
+        self.folder = folder
+        self.filename = filename
+        self.digest = digest
+        self.refcount = refcount
+
+    def __repr__(self):
+        return f"Blob('{self.folder}', '{self.filename}', '{self.refcount}')"
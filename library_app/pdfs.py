@@ -0,0 +1,205 @@
+import os
+import posixpath
+import threading
+import fitz
+from hashlib import sha256
+from collections import namedtuple
+from functools import wraps
+from datetime import datetime, timezone
+from flask import current_app, send_file, abort, request, url_for
+from PIL import Image
+from library_app.models import IssuedBook
+from library_app.cache import DiskCache
+from library_app.blobs import blob_store
+
+PDF_FOLDER = "book/pdfs/"
+
+PdfShape = namedtuple("PdfShape", ["page_count", "width", "height"])
+
+PdfInfo = namedtuple(
+    "PdfInfo",
+    ["pdf_file", "page_count", "size", "digest", "page_width", "page_height"],
+    defaults=(0, 0, None, 0.0, 0.0),
+)
+
+LINEARIZE_PDFS = tuple(int(part) for part in fitz.VersionBind.split(".")[:2]) < (1, 26)
+
+
+class PdfDelivery:
+    def __init__(self):
+        self.sendfile = ""
+        self.accel_prefix = "/protected/pdfs/"
+        self.max_age = 3600
+
+    def init_app(self, app):
+        self.sendfile = app.config["PDF_SENDFILE"]
+        self.accel_prefix = app.config["PDF_ACCEL_PREFIX"]
+        self.max_age = app.config["PDF_MAX_AGE"]
+        if self.sendfile not in ("", "x-accel", "x-sendfile"):
+            raise ValueError(f"Unknown PDF sendfile mode {self.sendfile!r}")
+        if self.sendfile == "x-accel" and blob_store.backend.remote:
+            raise ValueError("PDF_SENDFILE=x-accel needs BLOB_BACKEND=local")
+        for endpoint in ("static", "assets"):
+            if endpoint in app.view_functions:
+                app.view_functions[endpoint] = self.protect(
+                    app.view_functions[endpoint]
+                )
+
+    def protect(self, view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            filename = posixpath.normpath(
+                kwargs["filename"].replace("\\", "/").lstrip("/")
+            )
+            if filename.startswith(PDF_FOLDER):
+                abort(404)
+            return view(**kwargs)
+
+        return wrapper
+
+    def path(self, book):
+        return blob_store.path(PDF_FOLDER, book.pdf_file)
+
+    def send(self, book):
+        path = self.path(book)
+        if not os.path.isfile(path):
+            abort(404)
+        if self.sendfile:
+            response = current_app.response_class(mimetype="application/pdf")
+            if self.sendfile == "x-accel":
+                response.headers["X-Accel-Redirect"] = (
+                    self.accel_prefix.rstrip("/") + "/" + book.pdf_file
+                )
+            else:
+                response.headers["X-Sendfile"] = path
+        else:
+            response = send_file(
+                path,
+                mimetype="application/pdf",
+                conditional=True,
+                max_age=self.max_age,
+            )
+        response.headers["Content-Disposition"] = "inline"
+        response.accept_ranges = "bytes"
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.max_age = self.max_age
+        return response
+
+
+class PdfPageRenderer:
+    def __init__(self):
+        self.pages = None
+        self.widths = (480, 800, 1200, 1600)
+        self.shapes = {}
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.pages = DiskCache(
+            app.config["PDF_PAGE_CACHE_FOLDER"]
+            or os.path.join(app.instance_path, "pages"),
+            app.config["PDF_PAGE_CACHE_MAX_BYTES"],
+        )
+        self.widths = tuple(sorted(app.config["PDF_PAGE_WIDTHS"]))
+        app.add_template_global(self.srcset, "page_srcset")
+
+    def shape(self, book):
+        if book.pdf_page_count:
+            return PdfShape(
+                book.pdf_page_count, book.pdf_page_width, book.pdf_page_height
+            )
+        path = pdf_delivery.path(book)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (book.pdf_file, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            shape = self.shapes.get(key)
+        if shape is None:
+            with fitz.open(path) as document:
+                rect = document[0].rect if document.page_count else fitz.Rect()
+                shape = PdfShape(document.page_count, rect.width, rect.height)
+            with self.lock:
+                self.shapes[key] = shape
+        return shape
+
+    def snap_width(self, width):
+        return next((size for size in self.widths if size >= width), self.widths[-1])
+
+    def srcset(self, endpoint, **values):
+        return ", ".join(
+            f"{url_for(endpoint, width=width, **values)} {width}w"
+            for width in self.widths
+        )
+
+    def render(self, book, page, width, image_format):
+        path = self.pages.path(
+            os.path.splitext(book.pdf_file)[0], f"{page}-{width}.{image_format}"
+        )
+        if self.pages.hit(path):
+            return path
+        with fitz.open(pdf_delivery.path(book)) as document:
+            pdf_page = document[page - 1]
+            zoom = width / pdf_page.rect.width
+            pixmap = pdf_page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+        if image_format == "webp":
+            return self.pages.store(
+                path, lambda target: image.save(target, "WEBP", quality=80, method=4)
+            )
+        return self.pages.store(
+            path, lambda target: image.save(target, "PNG", optimize=True)
+        )
+
+    def send(self, book, page, width, public=False):
+        shape = self.shape(book)
+        if shape is None or not 1 <= page <= shape.page_count:
+            abort(404)
+        best = request.accept_mimetypes.best_match(["image/webp", "image/png"])
+        image_format = "webp" if best == "image/webp" else "png"
+        path = self.render(book, page, self.snap_width(width), image_format)
+        response = send_file(
+            path,
+            mimetype=f"image/{image_format}",
+            conditional=True,
+            max_age=pdf_delivery.max_age,
+        )
+        response.vary.add("Accept")
+        if not public:
+            response.cache_control.public = False
+            response.cache_control.private = True
+        return response
+
+
+def pdf_info(pdf_file, path):
+    digest = sha256()
+    with open(path, "rb") as pdf:
+        for chunk in iter(lambda: pdf.read(1024 * 1024), b""):
+            digest.update(chunk)
+    with fitz.open(path) as document:
+        rect = document[0].rect if document.page_count else fitz.Rect()
+        return PdfInfo(
+            pdf_file,
+            document.page_count,
+            os.path.getsize(path),
+            digest.hexdigest(),
+            rect.width,
+            rect.height,
+        )
+
+
+def has_current_issue(user, bookid):
+    return (
+        IssuedBook.query.filter(
+            IssuedBook.userid == user.userid,
+            IssuedBook.bookid == bookid,
+            IssuedBook.status == "current",
+            IssuedBook.to_date >= datetime.now(timezone.utc).date(),
+        ).first()
+        is not None
+    )
+
+
+pdf_delivery = PdfDelivery()
+pdf_pages = PdfPageRenderer()
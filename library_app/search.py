@@ -0,0 +1,315 @@
+import re
+from math import ceil
+import fitz
+from collections import namedtuple
+from markupsafe import Markup, escape
+from sqlalchemy import text, func, cast, Float
+from library_app import db
+from library_app.models import Section, Book, BookPage, BookTrigram
+from library_app.blobs import blob_store
+
+SearchResults = namedtuple(
+    "SearchResults",
+    ["sections", "books", "section_snippets", "book_snippets", "page", "has_next"],
+)
+
+PageSearchResults = namedtuple(
+    "PageSearchResults", ["books", "page_hits", "page", "has_next"]
+)
+
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+CATALOG_FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE catalog_fts USING fts5(
+        title, author, description, section,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER catalog_fts_book_insert AFTER INSERT ON book BEGIN
+        INSERT INTO catalog_fts(rowid, title, author, description, section)
+        VALUES (
+            new.bookid * 2, new.title, new.author, new.description,
+            (SELECT title FROM section WHERE sectionid = new.sectionid)
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER catalog_fts_book_update
+    AFTER UPDATE OF title, author, description, sectionid ON book BEGIN
+        DELETE FROM catalog_fts WHERE rowid = old.bookid * 2;
+        INSERT INTO catalog_fts(rowid, title, author, description, section)
+        VALUES (
+            new.bookid * 2, new.title, new.author, new.description,
+            (SELECT title FROM section WHERE sectionid = new.sectionid)
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER catalog_fts_book_delete AFTER DELETE ON book BEGIN
+        DELETE FROM catalog_fts WHERE rowid = old.bookid * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER catalog_fts_section_insert AFTER INSERT ON section BEGIN
+        INSERT INTO catalog_fts(rowid, title, author, description, section)
+        VALUES (new.sectionid * 2 + 1, new.title, '', new.description, '');
+    END
+    """,
+    """
+    CREATE TRIGGER catalog_fts_section_update
+    AFTER UPDATE OF title, description ON section BEGIN
+        DELETE FROM catalog_fts WHERE rowid = old.sectionid * 2 + 1;
+        INSERT INTO catalog_fts(rowid, title, author, description, section)
+        VALUES (new.sectionid * 2 + 1, new.title, '', new.description, '');
+        UPDATE catalog_fts SET section = new.title
+        WHERE rowid IN (SELECT bookid * 2 FROM book WHERE sectionid = new.sectionid);
+    END
+    """,
+    """
+    CREATE TRIGGER catalog_fts_section_delete AFTER DELETE ON section BEGIN
+        DELETE FROM catalog_fts WHERE rowid = old.sectionid * 2 + 1;
+    END
+    """,
+]
+
+BOOK_PAGE_FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE book_page_fts USING fts5(
+        content,
+        content = 'book_page',
+        content_rowid = 'pageid',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER book_page_fts_insert AFTER INSERT ON book_page BEGIN
+        INSERT INTO book_page_fts(rowid, content) VALUES (new.pageid, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER book_page_fts_delete AFTER DELETE ON book_page BEGIN
+        INSERT INTO book_page_fts(book_page_fts, rowid, content)
+        VALUES ('delete', old.pageid, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER book_page_book_delete AFTER DELETE ON book BEGIN
+        DELETE FROM book_page WHERE bookid = old.bookid;
+    END
+    """,
+    "INSERT INTO book_page_fts(book_page_fts) VALUES ('rebuild')",
+]
+
+BOOK_TRIGRAM_SCHEMA = [
+    """
+    CREATE TRIGGER book_trigram_book_delete AFTER DELETE ON book BEGIN
+        DELETE FROM book_trigram WHERE bookid = old.bookid;
+    END
+    """,
+]
+
+CATALOG_FTS_POPULATE = [
+    "DELETE FROM catalog_fts",
+    """
+    INSERT INTO catalog_fts(rowid, title, author, description, section)
+    SELECT book.bookid * 2, book.title, book.author, book.description, section.title
+    FROM book JOIN section ON section.sectionid = book.sectionid
+    """,
+    """
+    INSERT INTO catalog_fts(rowid, title, author, description, section)
+    SELECT sectionid * 2 + 1, title, '', description, '' FROM section
+    """,
+]
+
+CATALOG_FTS_SEARCH = text(
+    f"""
+    SELECT rowid,
+        snippet(catalog_fts, -1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '...', 12)
+    FROM catalog_fts
+    WHERE catalog_fts MATCH :query
+    ORDER BY bm25(catalog_fts, 10.0, 5.0, 1.0, 2.0)
+    LIMIT :limit OFFSET :offset
+    """
+)
+
+BOOK_PAGE_FTS_SEARCH = text(
+    f"""
+    SELECT book_page.bookid, book_page.page_number,
+        snippet(book_page_fts, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '...', 16)
+    FROM book_page_fts JOIN book_page ON book_page.pageid = book_page_fts.rowid
+    WHERE book_page_fts MATCH :query
+    ORDER BY bm25(book_page_fts)
+    LIMIT :limit OFFSET :offset
+    """
+)
+
+
+def create_search_index():
+    populate_trigrams = False
+    with db.engine.begin() as connection:
+        for table, statements in (
+            ("catalog_fts", CATALOG_FTS_SCHEMA + CATALOG_FTS_POPULATE),
+            ("book_page_fts", BOOK_PAGE_FTS_SCHEMA),
+            ("book_trigram_book_delete", BOOK_TRIGRAM_SCHEMA),
+        ):
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                {"name": table},
+            ).first()
+            if exists:
+                continue
+            for statement in statements:
+                connection.execute(text(statement))
+            if table == "book_trigram_book_delete":
+                populate_trigrams = True
+    if populate_trigrams:
+        rebuild_trigram_index()
+
+
+def rebuild_search_index():
+    with db.engine.begin() as connection:
+        for statement in CATALOG_FTS_POPULATE:
+            connection.execute(text(statement))
+    rebuild_trigram_index()
+
+
+def build_match_query(search_term):
+    terms = re.findall(r"\w+", search_term.lower())
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def highlight(snippet):
+    return Markup(
+        str(escape(snippet))
+        .replace(HIGHLIGHT_START, "<mark>")
+        .replace(HIGHLIGHT_END, "</mark>")
+    )
+
+
+def search_catalog(search_term, page, per_page):
+    query = build_match_query(search_term)
+    if not query:
+        return SearchResults([], [], {}, {}, page, False)
+    rows = db.session.execute(
+        CATALOG_FTS_SEARCH,
+        {"query": query, "limit": per_page + 1, "offset": (page - 1) * per_page},
+    ).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    section_snippets = {
+        rowid // 2: highlight(snippet) for rowid, snippet in rows if rowid % 2
+    }
+    book_snippets = {
+        rowid // 2: highlight(snippet) for rowid, snippet in rows if not rowid % 2
+    }
+    sections = Section.query.filter(Section.sectionid.in_(section_snippets)).all()
+    books = Book.query.filter(Book.bookid.in_(book_snippets)).all()
+    ranks = {rowid: rank for rank, (rowid, snippet) in enumerate(rows)}
+    sections.sort(key=lambda x: ranks[x.sectionid * 2 + 1])
+    books.sort(key=lambda x: ranks[x.bookid * 2])
+    return SearchResults(
+        sections, books, section_snippets, book_snippets, page, has_next
+    )
+
+
+def extract_pdf_pages(pdf_path):
+    with fitz.open(pdf_path) as pdf_document:
+        return [
+            (page_number, page.get_text())
+            for page_number, page in enumerate(pdf_document, start=1)
+        ]
+
+
+def index_book_pages(book):
+    BookPage.query.filter_by(bookid=book.bookid).delete()
+    if book.pdf_file != "sample_pdf.pdf":
+        pdf_path = blob_store.path("book/pdfs", book.pdf_file)
+        db.session.add_all(
+            BookPage(bookid=book.bookid, page_number=page_number, content=content)
+            for page_number, content in extract_pdf_pages(pdf_path)
+            if content.strip()
+        )
+    db.session.commit()
+
+
+def search_book_pages(search_term, page, per_page):
+    query = build_match_query(search_term)
+    if not query:
+        return PageSearchResults([], {}, page, False)
+    rows = db.session.execute(
+        BOOK_PAGE_FTS_SEARCH,
+        {"query": query, "limit": per_page + 1, "offset": (page - 1) * per_page},
+    ).all()
+    has_next = len(rows) > per_page
+    page_hits = {}
+    for bookid, page_number, snippet in rows[:per_page]:
+        page_hits.setdefault(bookid, []).append((page_number, highlight(snippet)))
+    books = Book.query.filter(Book.bookid.in_(page_hits)).all()
+    ranks = {bookid: rank for rank, bookid in enumerate(page_hits)}
+    books.sort(key=lambda x: ranks[x.bookid])
+    return PageSearchResults(books, page_hits, page, has_next)
+
+
+def trigrams(*texts):
+    grams = set()
+    for text_value in texts:
+        for word in re.findall(r"\w+", text_value.lower()):
+            padded = f"  {word} "
+            grams.update(padded[start : start + 3] for start in range(len(word) + 1))
+    return grams
+
+
+def index_book_trigrams(book):
+    grams = trigrams(book.title, book.author)
+    BookTrigram.query.filter_by(bookid=book.bookid).delete()
+    db.session.add_all(BookTrigram(trigram=gram, bookid=book.bookid) for gram in grams)
+    book.trigram_count = len(grams)
+    db.session.commit()
+
+
+def rebuild_trigram_index():
+    postings, counts = [], []
+    for bookid, title, author in db.session.query(
+        Book.bookid, Book.title, Book.author
+    ):
+        grams = trigrams(title, author)
+        postings.extend((gram, bookid) for gram in grams)
+        counts.append({"bookid": bookid, "trigram_count": len(grams)})
+    postings.sort()
+    BookTrigram.query.delete()
+    if postings:
+        db.session.connection().exec_driver_sql(
+            "INSERT INTO book_trigram (trigram, bookid) VALUES (?, ?)", postings
+        )
+    db.session.bulk_update_mappings(Book, counts)
+    db.session.commit()
+
+
+def search_fuzzy(search_term, page, per_page, threshold):
+    grams = trigrams(search_term)
+    if not grams:
+        return SearchResults([], [], {}, {}, page, False)
+    shared = func.count(BookTrigram.trigram).label("shared")
+    matches = (
+        db.session.query(BookTrigram.bookid, shared)
+        .filter(BookTrigram.trigram.in_(grams))
+        .group_by(BookTrigram.bookid)
+        .having(shared >= ceil(threshold * len(grams)))
+        .subquery()
+    )
+    similarity = cast(matches.c.shared, Float) / (
+        len(grams) + Book.trigram_count - matches.c.shared
+    )
+    books = (
+        Book.query.join(matches, matches.c.bookid == Book.bookid)
+        .order_by(similarity.desc(), Book.bookid)
+        .limit(per_page + 1)
+        .offset((page - 1) * per_page)
+        .all()
+    )
+    has_next = len(books) > per_page
+    return SearchResults([], books[:per_page], {}, {}, page, has_next)
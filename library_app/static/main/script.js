@@ -17,3 +17,49 @@ function showPassword() {
         );
     }
 }
+
+document.addEventListener("DOMContentLoaded", function () {
+    let searchInput = document.querySelector("#searchInput");
+    let autocompleteList = document.querySelector("#autocompleteList");
+    if (!searchInput || !autocompleteList) {
+        return;
+    }
+    let controller = null;
+    searchInput.addEventListener("input", function () {
+        if (controller) {
+            controller.abort();
+        }
+        let prefix = searchInput.value.trim();
+        if (!prefix) {
+            autocompleteList.classList.add("d-none");
+            return;
+        }
+        controller = new AbortController();
+        let url =
+            searchInput.dataset.autocompleteUrl +
+            "?q=" +
+            encodeURIComponent(prefix);
+        fetch(url, { signal: controller.signal })
+            .then((response) => response.json())
+            .then(function (suggestions) {
+                autocompleteList.innerHTML = "";
+                suggestions.forEach(function (suggestion) {
+                    let item = document.createElement("a");
+                    item.className = "list-group-item list-group-item-action";
+                    item.href = suggestion.url;
+                    item.textContent = suggestion.label;
+                    autocompleteList.appendChild(item);
+                });
+                autocompleteList.classList.toggle(
+                    "d-none",
+                    suggestions.length === 0
+                );
+            })
+            .catch(function () {});
+    });
+    document.addEventListener("click", function (event) {
+        if (!autocompleteList.contains(event.target) && event.target !== searchInput) {
+            autocompleteList.classList.add("d-none");
+        }
+    });
+});
@@ -0,0 +1,192 @@
+import json
+import math
+import os
+from collections import namedtuple
+from hashlib import sha256
+from datetime import datetime, timezone
+from flask import current_app, render_template, jsonify, request
+from library_app import db
+from library_app.models import Section, Book, IssuedBook
+from library_app.cache import catalog_cache
+from library_app.jobs import job_queue, PENDING_STATUSES
+from library_app.charts import CHART_COLORS, chart_renderer
+
+STATS_FOLDER = "user/stats"
+STATS_SECTIONS = 4
+CHART_NAMES = ("bar", "pie")
+
+SectionCount = namedtuple("SectionCount", ["section", "count"])
+
+
+@catalog_cache.cached
+def section_counts(urole, userid, stats_version):
+    issuer = IssuedBook.issued_by if urole == "librarian" else IssuedBook.userid
+    count = db.func.count(IssuedBook.issueid)
+    rows = (
+        db.session.query(Section.title, count)
+        .outerjoin(Book, Book.sectionid == Section.sectionid)
+        .outerjoin(
+            IssuedBook, db.and_(IssuedBook.bookid == Book.bookid, issuer == userid)
+        )
+        .group_by(Section.sectionid, Section.title)
+        .order_by(count.desc(), Section.sectionid)
+        .all()
+    )
+    counts = tuple(SectionCount(title, total) for title, total in rows)
+    if len(counts) > STATS_SECTIONS:
+        others = sum(section.count for section in counts[STATS_SECTIONS:])
+        counts = counts[:STATS_SECTIONS] + (SectionCount("Others", others),)
+    return counts
+
+
+def user_section_counts(user):
+    return section_counts(user.urole, user.userid, user.stats_version)
+
+
+def counts_digest(counts):
+    return sha256(json.dumps(counts).encode()).hexdigest()[:16]
+
+
+def chart_path(user, chart):
+    return os.path.join(
+        current_app.root_path,
+        "static",
+        STATS_FOLDER,
+        f"{user.username}_{chart}_chart.png",
+    )
+
+
+def bar_chart(counts):
+    width, height = 640, 400
+    left, right, top, bottom = 50, 20, 20, 100
+    plot_width, plot_height = width - left - right, height - top - bottom
+    peak = max((section.count for section in counts), default=0)
+    step = max(1, math.ceil(peak / 5))
+    ceiling = step * max(1, math.ceil(peak / step))
+    slot = plot_width / max(1, len(counts))
+    bars = []
+    for index, section in enumerate(counts):
+        bar_height = plot_height * section.count / ceiling
+        bars.append(
+            {
+                "section": section.section,
+                "count": section.count,
+                "x": round(left + slot * (index + 0.2), 2),
+                "y": round(top + plot_height - bar_height, 2),
+                "width": round(slot * 0.6, 2),
+                "height": round(bar_height, 2),
+                "center": round(left + slot * (index + 0.5), 2),
+                "color": CHART_COLORS[index % len(CHART_COLORS)],
+            }
+        )
+    ticks = [
+        {"value": value, "y": round(top + plot_height * (1 - value / ceiling), 2)}
+        for value in range(0, ceiling + 1, step)
+    ]
+    return render_template(
+        "charts/bar_chart.svg",
+        width=width,
+        height=height,
+        left=left,
+        right=width - right,
+        baseline=top + plot_height,
+        bars=bars,
+        ticks=ticks,
+    )
+
+
+def arc_point(cx, cy, radius, angle):
+    return (
+        round(cx + radius * math.sin(angle), 2),
+        round(cy - radius * math.cos(angle), 2),
+    )
+
+
+def pie_chart(counts):
+    cx, cy, outer, inner = 200, 200, 160, 112
+    total = sum(section.count for section in counts)
+    slices = []
+    start = 0.0
+    for index, section in enumerate(counts):
+        if not section.count:
+            continue
+        share = section.count / total
+        end = start + 2 * math.pi * share
+        middle = arc_point(cx, cy, (outer + inner) / 2, (start + end) / 2)
+        large = 1 if end - start > math.pi else 0
+        x1, y1 = arc_point(cx, cy, outer, start)
+        x2, y2 = arc_point(cx, cy, outer, end)
+        x3, y3 = arc_point(cx, cy, inner, end)
+        x4, y4 = arc_point(cx, cy, inner, start)
+        slices.append(
+            {
+                "section": section.section,
+                "count": section.count,
+                "percent": f"{share * 100:.1f}%",
+                "full": share == 1,
+                "path": (
+                    f"M{x1} {y1} A{outer} {outer} 0 {large} 1 {x2} {y2} "
+                    f"L{x3} {y3} A{inner} {inner} 0 {large} 0 {x4} {y4} Z"
+                ),
+                "label_x": middle[0],
+                "label_y": middle[1],
+                "color": CHART_COLORS[index % len(CHART_COLORS)],
+            }
+        )
+        start = end
+    return render_template(
+        "charts/pie_chart.svg",
+        cx=cx,
+        cy=cy,
+        outer=outer,
+        inner=inner,
+        slices=slices,
+    )
+
+
+def counts_response(counts):
+    response = jsonify(
+        {
+            "sections": [section._asdict() for section in counts],
+            "total": sum(section.count for section in counts),
+        }
+    )
+    return revalidate(response, counts_digest(counts))
+
+
+def chart_response(counts, chart):
+    draw = bar_chart if chart == "bar" else pie_chart
+    response = current_app.response_class(draw(counts), mimetype="image/svg+xml")
+    return revalidate(response, f"{chart}-{counts_digest(counts)}")
+
+
+def revalidate(response, etag):
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def save_chart_pngs(user, counts):
+    chart_renderer.render(
+        counts, {chart: chart_path(user, chart) for chart in CHART_NAMES}
+    )
+
+
+def refresh_chart_pngs(user, counts):
+    digest = counts_digest(counts)
+    subject = f"stats:{user.userid}"
+    job = job_queue.latest(subject)
+    if job is not None and job.status in PENDING_STATUSES:
+        return job
+    if job is not None and json.loads(job.payload).get("digest") == digest:
+        if job.status == "failed":
+            failed_at = job.date_updated.replace(tzinfo=timezone.utc)
+            age = (datetime.now(timezone.utc) - failed_at).total_seconds()
+            if age < current_app.config["STATS_CHART_MAX_AGE"]:
+                return job
+        elif all(os.path.exists(chart_path(user, chart)) for chart in CHART_NAMES):
+            return job
+    return job_queue.enqueue(
+        "generate_stats_charts", {"userid": user.userid, "digest": digest}, subject
+    )
@@ -0,0 +1,101 @@
+import os
+from flask import current_app
+from flask_mail import Message
+from werkzeug.datastructures import FileStorage
+from library_app import db, mail
+from library_app.models import Book, User
+from library_app.jobs import job_queue
+from library_app.cache import catalog_cache
+from library_app.search import index_book_pages
+from library_app.utils import save_picture, delete_file
+from library_app.librarian.utils import save_pdf
+from library_app.stats import user_section_counts, save_chart_pngs
+
+
+def staged_path(upload):
+    return os.path.join(current_app.instance_path, "uploads", upload)
+
+
+def open_staged(upload):
+    return FileStorage(open(staged_path(upload), "rb"), filename=upload)
+
+
+def discard_staged(upload):
+    if os.path.exists(staged_path(upload)):
+        os.remove(staged_path(upload))
+
+
+@job_queue.task("send_email")
+def send_email(subject, sender, recipients, body):
+    mail.send(Message(subject, sender=sender, recipients=recipients, body=body))
+
+
+@job_queue.task("save_book_picture")
+def save_book_picture(bookid, upload):
+    if not os.path.exists(staged_path(upload)):
+        return
+    book = db.session.get(Book, bookid)
+    if book is None:
+        discard_staged(upload)
+        return
+    staged = open_staged(upload)
+    try:
+        picture = save_picture(staged, "book/pictures")
+    finally:
+        staged.close()
+    old_picture = book.picture
+    try:
+        book.picture = picture
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        delete_file("book/pictures", picture)
+        raise
+    if old_picture != "default_book_picture.png":
+        delete_file("book/pictures", old_picture)
+    discard_staged(upload)
+    catalog_cache.invalidate()
+
+
+@job_queue.task("save_book_pdf")
+def save_book_pdf(bookid, upload):
+    if not os.path.exists(staged_path(upload)):
+        return
+    book = db.session.get(Book, bookid)
+    if book is None:
+        discard_staged(upload)
+        return
+    staged = open_staged(upload)
+    try:
+        pdf = save_pdf(staged, "book/pdfs")
+    finally:
+        staged.close()
+    old_pdf_file = book.pdf_file
+    try:
+        book.set_pdf(pdf)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        delete_file("book/pdfs", pdf.pdf_file)
+        raise
+    if old_pdf_file != "sample_pdf.pdf":
+        delete_file("book/pdfs", old_pdf_file)
+    discard_staged(upload)
+    catalog_cache.invalidate()
+    job_queue.enqueue("index_book_pages", {"bookid": bookid}, f"book:{bookid}")
+
+
+@job_queue.task("index_book_pages")
+def index_pages(bookid):
+    book = db.session.get(Book, bookid)
+    if book is not None:
+        index_book_pages(book)
+
+
+@job_queue.task("generate_stats_charts")
+@job_queue.task("generate_user_plots")
+@job_queue.task("generate_librarian_plots")
+def generate_stats_charts(userid, **metadata):
+    user = db.session.get(User, userid)
+    if user is not None:
+        save_chart_pngs(user, user_section_counts(user))
@@ -10,8 +10,9 @@ from flask import (
     request,
 )
 from flask_login import login_user, current_user, logout_user
+from sqlalchemy.orm import joinedload, selectinload
 from library_app import db, bcrypt
-from library_app.models import User, Section, Request, Feedback, IssuedBook, Book
+from library_app.models import User, Request, Feedback, IssuedBook, Book
 from library_app.forms import (
     LoginForm,
     EditProfileForm,
@@ -32,7 +33,26 @@ from library_app.utils import (
     send_reset_email,
     delete_file,
 )
-from library_app.user.utils import generate_plots
+from library_app.catalog import (
+    sorted_sections,
+    sorted_sections_with_books,
+    section_books_page,
+    book_details,
+    search_books,
+    catalog_last_modified,
+    book_last_modified,
+)
+from library_app.cache import catalog_cache, conditional
+from library_app.user.utils import issued_state
+from library_app.pdfs import pdf_delivery, pdf_pages, has_current_issue
+from library_app.stats import (
+    CHART_NAMES,
+    user_section_counts,
+    counts_digest,
+    counts_response,
+    chart_response,
+    refresh_chart_pngs,
+)
 
 user = Blueprint("user", __name__)
 
@@ -43,7 +63,7 @@ def register():
     form = RegistrationForm()
     if form.validate_on_submit():
         if form.profile_picture.data:
-            profile_picture = save_picture(form.profile_picture.data, "user\\profile_pictures")
+            profile_picture = save_picture(form.profile_picture.data, "user/profile_pictures")
         else:
             profile_picture = "default_profile_picture.png"
         user = User(
@@ -95,9 +115,9 @@ def login():
 
 @user.route("/user/sections")
 @login_required(role="user")
+@conditional(catalog_last_modified)
 def sections():
-    sections = Section.query.order_by(Section.date_created.desc()).all()
-    sections.sort(key=lambda x: len(x.books), reverse=True)
+    sections = sorted_sections()
     return render_template(
         "user/sections.html",
         title="Sections",
@@ -111,52 +131,43 @@ def sections():
 @login_required(role="user")
 def search():
     if request.method == "POST":
-        search_term = request.form["search_term"]
-        sections = (
-            Section.query.filter(Section.title.ilike(f"%{search_term}%"))
-            .order_by(Section.date_created.desc())
-            .all()
-        )
-        books = Book.query.filter(Book.title.ilike(f"%{search_term}%")).all()
-        books.sort(
-            key=lambda x: (
-                sum(feedback.rating for feedback in x.feedbacks),
-                x.date_created,
-            ),
-            reverse=True,
-        )
-        authors = Book.query.filter(Book.author.ilike(f"%{search_term}%")).all()
-        authors.sort(
-            key=lambda x: (
-                sum(feedback.rating for feedback in x.feedbacks),
-                x.date_created,
-            ),
-            reverse=True,
-        )
-        return render_template(
-            "user/search.html",
-            title="Search",
-            user=current_user,
-            sections=sections,
-            books=books,
-            authors=authors,
+        return redirect(
+            url_for("user.search", search_term=request.form["search_term"])
         )
-    else:
+    search_term = request.args.get("search_term", "").strip()
+    if not search_term:
         return redirect(url_for("user.books"))
+    catalog_search = search_books(
+        search_term,
+        request.args.get("mode", "catalog"),
+        request.args.get("page", 1, type=int),
+    )
+    return render_template(
+        "user/search.html",
+        title="Search",
+        user=current_user,
+        search_term=search_term,
+        mode=catalog_search.mode,
+        results=catalog_search.results,
+        sections=catalog_search.sections,
+        books=catalog_search.books,
+    )
 
 
 @user.route("/user/section-books/<int:sectionid>")
 @login_required(role="user")
+@conditional(catalog_last_modified)
 def section_books(sectionid):
-    section = Section.query.get(sectionid)
-    sorted_books = sorted(
-        section.books,
-        key=lambda x: (
-            sum(feedback.rating for feedback in x.feedbacks),
-            x.date_created,
-        ),
-        reverse=True,
+    listing = section_books_page(
+        sectionid,
+        per_page=request.args.get("per_page", type=int),
+        after=request.args.get("after"),
+        before=request.args.get("before"),
     )
+    if listing is None:
+        abort(404)
+    section, page = listing
+    sorted_books = page.books
     return render_template(
         "user/section_books.html",
         title=f"{section.title} Books",
@@ -164,25 +175,15 @@ def section_books(sectionid):
         navbaractive=["Books"],
         section=section,
         sorted_books=sorted_books,
+        page=page,
     )
 
 
 @user.route("/user/books")
 @login_required(role="user")
+@conditional(catalog_last_modified, issued_state)
 def books():
-    sections = Section.query.order_by(Section.date_created.desc()).all()
-    sections.sort(key=lambda x: len(x.books), reverse=True)
-    sorted_sections = []
-    for section in sections:
-        sorted_books = sorted(
-            section.books,
-            key=lambda x: (
-                sum(feedback.rating for feedback in x.feedbacks),
-                x.date_created,
-            ),
-            reverse=True,
-        )
-        sorted_sections.append((section, sorted_books))
+    sorted_sections = sorted_sections_with_books()
     issuedbookids = {
         issuedbook.bookid: issuedbook.issueid
         for issuedbook in current_user.issuedbooks
@@ -206,15 +207,13 @@ def books():
 
 @user.route("/user/book-info/<int:bookid>")
 @login_required(role="user")
+@conditional(book_last_modified, issued_state)
 def book_info(bookid):
-    book = Book.query.get(bookid)
-    if book is None:
+    details = book_details(bookid)
+    if details is None:
         flash("Book not found", "danger")
         return redirect(url_for("user.books"))
-    feedbacks = sorted(
-        book.feedbacks, key=lambda x: (x.rating, x.date_created), reverse=True
-    )
-    pdf_file = url_for("static", filename="book/pdfs/" + book.pdf_file)
+    book, feedbacks = details
     issuedbookids = {
         issuedbook.bookid: issuedbook.issueid
         for issuedbook in current_user.issuedbooks
@@ -233,9 +232,7 @@ def book_info(bookid):
         feedbacks=feedbacks,
         issuedbookids=issuedbookids,
         feedbackbookids=feedbackbookids,
-        pdf_file=pdf_file,
         navbaractive=["Books"],
-        sections=sections,
     )
 
 
@@ -302,7 +299,12 @@ def delete_request(requestid):
 @login_required(role="user")
 def mybooks():
     current, completed = [], []
-    for issuedbook in IssuedBook.query.filter_by(userid=current_user.userid).all():
+    issuedbooks = (
+        IssuedBook.query.filter_by(userid=current_user.userid)
+        .options(joinedload(IssuedBook.book))
+        .all()
+    )
+    for issuedbook in issuedbooks:
         if issuedbook.status == "current":
             if datetime.now(timezone.utc).date() > issuedbook.to_date:
                 issuedbook.status = "returned"
@@ -311,28 +313,19 @@ def mybooks():
             current.append(issuedbook)
         else:
             completed.append(issuedbook)
-    current.sort(
-        key=lambda x: (
-            x.to_date,
-            -sum(feedback.rating for feedback in x.book.feedbacks),
-        )
-    )
-    current2 = []
-    for issuedbook in current:
-        feedbackid = None
-        for feedback in issuedbook.book.feedbacks:
-            if current_user.userid == feedback.userid:
-                feedbackid = feedback.feedbackid
-                break
-        current2.append((feedbackid, issuedbook))
-    completed.sort(
-        key=lambda x: (
-            x.to_date,
-            sum(feedback.rating for feedback in x.book.feedbacks),
-        ),
-        reverse=True,
+    current.sort(key=lambda x: (x.to_date, -x.book.rating_sum))
+    feedbackids = {
+        feedback.bookid: feedback.feedbackid for feedback in current_user.feedbacks
+    }
+    current2 = [
+        (feedbackids.get(issuedbook.bookid), issuedbook) for issuedbook in current
+    ]
+    completed.sort(key=lambda x: (x.to_date, x.book.rating_sum), reverse=True)
+    requests = (
+        Request.query.filter_by(userid=current_user.userid)
+        .options(selectinload(Request.book))
+        .all()
     )
-    requests = list(current_user.requests)
     status_order = {"pending": 0, "rejected": 1, "accepted": 2}
     requests.sort(key=lambda x: (status_order[x.status], x.date_created))
     return render_template(
@@ -362,17 +355,39 @@ def view_book(bookid):
     if flag:
         abort(403)
     book = Book.query.get(bookid)
-    pdf_file = url_for("static", filename="book/pdfs/" + book.pdf_file)
     return render_template(
         "user/view_book.html",
         title="View Book",
         book=book,
+        shape=pdf_pages.shape(book),
         user=current_user,
-        pdf_file=pdf_file,
         navbactive=["MyBooks"],
     )
 
 
+@user.route("/user/book-pdf/<int:bookid>")
+@login_required(role="user")
+def book_pdf(bookid):
+    if not has_current_issue(current_user, bookid):
+        abort(403)
+    book = Book.query.get(bookid)
+    if book is None:
+        abort(404)
+    return pdf_delivery.send(book)
+
+
+@user.route("/user/book-page/<int:bookid>/<int:page>")
+@login_required(role="user")
+def book_page(bookid, page):
+    if not has_current_issue(current_user, bookid):
+        abort(403)
+    book = Book.query.get(bookid)
+    if book is None:
+        abort(404)
+    width = request.args.get("width", 800, type=int)
+    return pdf_pages.send(book, page, width)
+
+
 @user.route("/user/return-book/<int:issueid>")
 @login_required(role="user")
 def return_book(issueid):
@@ -430,11 +445,13 @@ def book_feedback(bookid):
             feedback = Feedback(
                 userid=current_user.userid,
                 bookid=form.bookid.data,
-                rating=form.rating.data,
+                rating=int(form.rating.data),
                 content=form.content.data,
             )
             db.session.add(feedback)
+            Book.query.get(form.bookid.data).update_rating(new_rating=feedback.rating)
             db.session.commit()
+            catalog_cache.invalidate()
             flash("Thanks for giving your feedback!", "success")
         except Exception as e:
             db.session.rollback()
@@ -472,13 +489,17 @@ def edit_feedback(feedbackid):
     if form.validate_on_submit():
         try:
             if (
-                feedback.rating != form.rating.data
+                feedback.rating != int(form.rating.data)
                 or feedback.content != form.content.data
             ):
                 flash("Your feedback has been edited!", "success")
-            feedback.rating = form.rating.data
+            feedback.book.update_rating(
+                old_rating=feedback.rating, new_rating=form.rating.data
+            )
+            feedback.rating = int(form.rating.data)
             feedback.content = form.content.data
             db.session.commit()
+            catalog_cache.invalidate()
         except Exception:
             db.session.rollback()
             flash("An error occurred while removing the completed book.", "danger")
@@ -499,12 +520,31 @@ def edit_feedback(feedbackid):
 @user.route("/user/stats")
 @login_required(role="user")
 def stats():
-    generate_plots()
+    counts = user_section_counts(current_user)
     return render_template(
-        "user/stats.html", title="Stats", user=current_user, navbaractive=["Stats"]
+        "user/stats.html",
+        title="Stats",
+        user=current_user,
+        digest=counts_digest(counts),
+        job=refresh_chart_pngs(current_user, counts),
+        navbaractive=["Stats"],
     )
 
 
+@user.route("/user/stats/sections.json")
+@login_required(role="user")
+def stats_sections():
+    return counts_response(user_section_counts(current_user))
+
+
+@user.route("/user/stats/<chart>.svg")
+@login_required(role="user")
+def stats_chart(chart):
+    if chart not in CHART_NAMES:
+        abort(404)
+    return chart_response(user_section_counts(current_user), chart)
+
+
 previous_user = None
 
 
@@ -575,18 +615,19 @@ def edit_profile():
                 flash("Your account has been updated!", "success")
             if form.profile_picture.data:
                 if current_user.profile_picture != "default_profile_picture.png":
-                    delete_file("user\\profile_pictures", current_user.profile_picture)
+                    delete_file("user/profile_pictures", current_user.profile_picture)
                 current_user.profile_picture = save_picture(
-                    form.profile_picture.data, "user\\profile_pictures"
+                    form.profile_picture.data, "user/profile_pictures"
                 )
             elif form.delete_profile_picture.data:
                 if current_user.profile_picture != "default_profile_picture.png":
-                    delete_file("user\\profile_pictures", current_user.profile_picture)
+                    delete_file("user/profile_pictures", current_user.profile_picture)
                 current_user.profile_picture = "default_profile_picture.png"
             current_user.name = form.name.data
             current_user.username = form.username.data
             current_user.email = form.email.data
             db.session.commit()
+            catalog_cache.invalidate()
             return redirect(url_for("user.account"))
         else:
             profile_picture = "default_profile_pic.png"
@@ -651,11 +692,14 @@ def delete_account():
     if form.validate_on_submit():
         if bcrypt.check_password_hash(current_user.password, form.password.data):
             if current_user.profile_picture != "default_profile_picture.png":
-                delete_file("user\\profile_pictures", current_user.profile_picture)
-            delete_file("user\\stats", f"{current_user.username}_bar_chart.png")
-            delete_file("user\\stats", f"{current_user.username}_pie_chart.png")
+                delete_file("user/profile_pictures", current_user.profile_picture)
+            delete_file("user/stats", f"{current_user.username}_bar_chart.png")
+            delete_file("user/stats", f"{current_user.username}_pie_chart.png")
+            for feedback in current_user.feedbacks:
+                feedback.book.update_rating(old_rating=feedback.rating)
             db.session.delete(current_user)
             db.session.commit()
+            catalog_cache.invalidate()
             logout_user()
             return redirect(url_for("main.sections"))
         else:
@@ -4,8 +4,18 @@ from PIL import Image
 from functools import wraps
 from flask import redirect, url_for, current_app, abort, flash
 from flask_login import current_user
-from flask_mail import Message
-from library_app import mail, login_manager
+from sqlalchemy import inspect, text
+from library_app import db, login_manager
+from library_app.jobs import job_queue
+from library_app.assets import variant_name
+from library_app.blobs import blob_store
+
+PICTURE_FOLDERS = {
+    "book": "book/pictures",
+    "section": "section",
+    "user": "user/profile_pictures",
+    "librarian": "librarian/profile_pictures",
+}
 
 
 def login_required(role="any"):
@@ -40,32 +50,89 @@ def check_user():
 
 
 def save_picture(picture, path, dim=(350, 350)):
-    picture_name = secrets.token_hex(16) + os.path.splitext(picture.filename)[1]
-    picture_path = os.path.join(current_app.root_path, "static", path, picture_name)
-    newpic = Image.open(picture)
-    newpic.thumbnail(dim)
-    newpic.save(picture_path)
-    return picture_name
+    return blob_store.put(
+        path, picture, lambda source, target: write_picture(source, target, dim)
+    )
+
+
+def write_picture(source, target, dim):
+    widths = current_app.config["PICTURE_WIDTHS"]
+    with Image.open(source) as newpic:
+        newpic.draft("RGB", (max(max(widths), *dim),) * 2)
+        save_picture_variants(newpic, target, widths)
+        newpic.thumbnail(dim)
+        newpic.save(target)
+
+
+def save_picture_variants(picture, picture_path, widths):
+    picture = convert_picture(picture)
+    for width in sorted(widths):
+        variant = resize_picture(picture, width)
+        variant.save(variant_name(picture_path, width), "WEBP", quality=80, method=4)
+        if picture.width <= width:
+            break
+
+
+def convert_picture(picture, alpha=True):
+    has_alpha = picture.mode in ("RGBA", "LA", "PA") or "transparency" in picture.info
+    if alpha and has_alpha:
+        return picture if picture.mode == "RGBA" else picture.convert("RGBA")
+    return picture if picture.mode == "RGB" else picture.convert("RGB")
+
+
+def resize_picture(picture, width):
+    if picture.width <= width:
+        return picture
+    height = max(1, round(picture.height * width / picture.width))
+    return picture.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+
+
+def stage_upload(upload):
+    upload_name = secrets.token_hex(16) + os.path.splitext(upload.filename)[1]
+    upload_folder = os.path.join(current_app.instance_path, "uploads")
+    os.makedirs(upload_folder, exist_ok=True)
+    upload.save(os.path.join(upload_folder, upload_name))
+    return upload_name
 
 
 def delete_file(path, file):
-    file_path = os.path.join(
-        current_app.root_path,
-        "static",
-        path,
-        file,
-    )
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    return blob_store.release(path, file)
+
 
 def send_reset_email(user, func):
     token = user.get_reset_token()
-    message = Message(
-        "Password Reset Request", sender="noreply@demo.com", recipients=[user.email]
-    )
-    message.body = f"""To reset your password, visit the following link:
+    body = f"""To reset your password, visit the following link:
 {url_for(func, token=token, _external=True)}
 
 If you did not make this request then simply ignore this email and no changes will be made.
 """
-    mail.send(message)
+    job_queue.enqueue(
+        "send_email",
+        {
+            "subject": "Password Reset Request",
+            "sender": "noreply@demo.com",
+            "recipients": [user.email],
+            "body": body,
+        },
+    )
+
+
+def upgrade_schema():
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing_columns = {
+                column["name"] for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                statement = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                if column.default is not None and column.default.is_scalar:
+                    if not column.nullable:
+                        statement += " NOT NULL"
+                    statement += f" DEFAULT {column.default.arg!r}"
+                connection.execute(text(statement))
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
@@ -0,0 +1,43 @@
+import os
+import tempfile
+from base64 import b64encode
+
+DATABASE = os.path.join(tempfile.mkdtemp(), "database.sqlite3")
+
+os.environ.update(
+    SECRET_KEY="test",
+    SQLALCHEMY_DATABASE_URI=f"sqlite:///{DATABASE}",
+    MAIL_USERNAME=b64encode(b"noreply@demo.com").decode("utf-8"),
+    MAIL_PASSWORD="",
+    CATALOG_CACHE_TTL="0",
+    PAGE_CACHE_MAX_BYTES="0",
+    JOB_WORKERS="0",
+    STATS_RENDER_PROCESSES="0",
+)
+
+import pytest
+from library_app import create_app, db
+from library_app.models import User
+
+
+@pytest.fixture(scope="session")
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        db.session.add_all(
+            [
+                User("Reader", "reader", "reader@x.com", "password", "reader.png"),
+                User(
+                    "Keeper",
+                    "keeper",
+                    "keeper@x.com",
+                    "password",
+                    "keeper.png",
+                    urole="librarian",
+                ),
+            ]
+        )
+        db.session.commit()
+    yield app
+    os.remove(DATABASE)
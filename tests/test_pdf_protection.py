@@ -0,0 +1,19 @@
+import pytest
+
+URLS = [
+    "/static/book/pdfs/sample_pdf.pdf",
+    "/static/book//pdfs/sample_pdf.pdf",
+    "/static/book/./pdfs/sample_pdf.pdf",
+    "/static/section/../book/pdfs/sample_pdf.pdf",
+]
+
+
+@pytest.mark.parametrize("url", URLS)
+def test_static_pdf_is_not_served(app, url):
+    assert app.test_client().get(url).status_code == 404
+
+
+@pytest.mark.parametrize("url", URLS)
+def test_hashed_pdf_is_not_served(app, url):
+    url = url.replace("/static/", "/assets/", 1).replace(".pdf", ".0123456789ab.pdf")
+    assert app.test_client().get(url).status_code == 404
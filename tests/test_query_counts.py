@@ -0,0 +1,89 @@
+from datetime import date, timedelta
+import pytest
+from sqlalchemy import event
+from library_app import db
+from library_app.models import User, Section, Book, Request, IssuedBook, Feedback
+
+ROUTES = {
+    "/sections": ("main", 4),
+    "/books": ("main", 5),
+    "/section-books/1": ("main", 5),
+    "/user/sections": ("user", 5),
+    "/user/books": ("user", 8),
+    "/user/section-books/1": ("user", 6),
+    "/librarian/requests": ("librarian", 12),
+}
+
+
+def add_rows(app, count):
+    with app.app_context():
+        reader = User.query.filter_by(username="reader").one()
+        keeper = User.query.filter_by(username="keeper").one()
+        first = Section.query.count()
+        for number in range(first, first + count):
+            section = Section(f"Section {number}", "About it", "section.png")
+            db.session.add(section)
+            db.session.flush()
+            for copy in range(3):
+                book = Book(
+                    f"Book {number}.{copy}",
+                    "Author",
+                    "book.png",
+                    "About it",
+                    sectionid=section.sectionid,
+                )
+                db.session.add(book)
+                db.session.flush()
+                db.session.add(Request(reader.userid, 3, book.bookid))
+                db.session.add(
+                    IssuedBook(
+                        reader.userid,
+                        keeper.userid,
+                        book.bookid,
+                        date.today(),
+                        date.today() + timedelta(days=3),
+                    )
+                )
+                db.session.add(Feedback(reader.userid, book.bookid, 4, "Good"))
+        db.session.commit()
+
+
+def client_for(app, role):
+    client = app.test_client()
+    if role != "main":
+        username = "reader" if role == "user" else "keeper"
+        with app.app_context():
+            userid = User.query.filter_by(username=username).one().userid
+        with client.session_transaction() as session:
+            session["_user_id"] = str(userid)
+            session["_fresh"] = True
+    return client
+
+
+def count_queries(app, client, url):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    client.get(url)
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize("url", ROUTES)
+def test_query_count_is_fixed(app, url):
+    role, expected = ROUTES[url]
+    client = client_for(app, role)
+    add_rows(app, 2)
+    few = count_queries(app, client, url)
+    add_rows(app, 20)
+    many = count_queries(app, client, url)
+    assert (few, many) == (expected, expected)